@@ -0,0 +1,108 @@
+"""
+Сжатые множества целых неотрицательных чисел (id) для индексов в памяти.
+
+Числа делятся на блоки по 2 ** 16 (как в Roaring bitmaps): хранятся
+только непустые блоки, каждый - битовая маска в целом Python.
+Пересечение, объединение и разность выполняются поблочно побитовыми
+операциями над целыми, то есть в C, без перебора отдельных id.
+"""
+from collections import defaultdict
+
+CHUNK_BITS = 16
+LOW_MASK = (1 << CHUNK_BITS) - 1
+
+
+class Bitmap:
+    """Неизменяемое множество id."""
+    __slots__ = ('chunks',)
+
+    def __init__(self, chunks=None):
+        self.chunks = chunks or {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        lows = defaultdict(list)
+        for value in ids:
+            lows[value >> CHUNK_BITS].append(value & LOW_MASK)
+        chunks = {}
+        for high, values in lows.items():
+            mask = bytearray((max(values) >> 3) + 1)
+            for low in values:
+                mask[low >> 3] |= 1 << (low & 7)
+            chunks[high] = int.from_bytes(mask, 'little')
+        return cls(chunks)
+
+    @classmethod
+    def union(cls, bitmaps):
+        chunks = {}
+        for bitmap in bitmaps:
+            for high, mask in bitmap.chunks.items():
+                chunks[high] = chunks.get(high, 0) | mask
+        return cls(chunks)
+
+    def changed(self, added=(), removed=()):
+        """Копия множества с добавленными added и удалёнными removed."""
+        chunks = dict(self.chunks)
+        for value in added:
+            high = value >> CHUNK_BITS
+            chunks[high] = chunks.get(high, 0) | 1 << (value & LOW_MASK)
+        for value in removed:
+            high = value >> CHUNK_BITS
+            mask = chunks.get(high, 0) & ~(1 << (value & LOW_MASK))
+            if mask:
+                chunks[high] = mask
+            else:
+                chunks.pop(high, None)
+        return Bitmap(chunks)
+
+    def __and__(self, other):
+        small, large = sorted((self.chunks, other.chunks), key=len)
+        chunks = {}
+        for high, mask in small.items():
+            mask &= large.get(high, 0)
+            if mask:
+                chunks[high] = mask
+        return Bitmap(chunks)
+
+    def __or__(self, other):
+        return Bitmap.union((self, other))
+
+    def __xor__(self, other):
+        chunks = dict(self.chunks)
+        for high, mask in other.chunks.items():
+            mask ^= chunks.get(high, 0)
+            if mask:
+                chunks[high] = mask
+            else:
+                chunks.pop(high, None)
+        return Bitmap(chunks)
+
+    def __sub__(self, other):
+        chunks = {}
+        for high, mask in self.chunks.items():
+            mask &= ~other.chunks.get(high, 0)
+            if mask:
+                chunks[high] = mask
+        return Bitmap(chunks)
+
+    def __bool__(self):
+        return bool(self.chunks)
+
+    def __len__(self):
+        return sum(bin(mask).count('1') for mask in self.chunks.values())
+
+    def __iter__(self):
+        for high in sorted(self.chunks):
+            base = high << CHUNK_BITS
+            mask = self.chunks[high]
+            while mask:
+                lowest = mask & -mask
+                yield base + lowest.bit_length() - 1
+                mask ^= lowest
+
+    def __contains__(self, value):
+        return bool(
+            self.chunks.get(value >> CHUNK_BITS, 0) >> (value & LOW_MASK) & 1)
+
+    def __repr__(self):
+        return f'<Bitmap: {len(self)}>'
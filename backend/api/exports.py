@@ -0,0 +1,85 @@
+import csv
+import json
+
+from django.conf import settings
+from django.db.models import Count, Max, Sum
+
+from recipes.models import ShoppingListItem
+
+CSV_HEADER = ('name', 'measurement_unit', 'amount')
+
+
+def get_shopping_list(user):
+    """Сводный список покупок пользователя."""
+    return ShoppingListItem.objects.filter(user=user).values(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'total_amount'
+    ).order_by('ingredient__name').iterator(
+        chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+def get_shopping_list_state(user):
+    """
+    Число строк, наибольший id и сумма количеств списка покупок:
+    меняются при любом пересчёте списка, в том числе в обход сигналов.
+    """
+    state = ShoppingListItem.objects.filter(user=user).aggregate(
+        count=Count('pk'), last_id=Max('pk'), total=Sum('total_amount'))
+    return '{count}:{last_id}:{total}'.format(**state)
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def stream_txt(items):
+    separator = ''
+    for item in items:
+        yield (f"{separator}{item['ingredient__name']} "
+               f"({item['ingredient__measurement_unit']}) — "
+               f"{item['total_amount']}")
+        separator = '\n'
+
+
+def stream_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for item in items:
+        yield writer.writerow((
+            item['ingredient__name'],
+            item['ingredient__measurement_unit'],
+            item['total_amount'],
+        ))
+
+
+def stream_json(items):
+    separator = ''
+    yield '['
+    for item in items:
+        yield separator + json.dumps(
+            dict(zip(CSV_HEADER, (
+                item['ingredient__name'],
+                item['ingredient__measurement_unit'],
+                item['total_amount'],
+            ))),
+            ensure_ascii=False
+        )
+        separator = ','
+    yield ']'
+
+
+def encode_stream(chunks):
+    """Кодирует части выгрузки в UTF-8."""
+    for chunk in chunks:
+        yield chunk.encode()
+
+
+EXPORT_FORMATS = {
+    'txt': stream_txt,
+    'csv': stream_csv,
+    'json': stream_json,
+}
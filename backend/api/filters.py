@@ -1,6 +1,45 @@
+from django import forms
+from django_filters import fields
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Ingredient, Recipe
+
+from .search import recipe_ingredient_index, tag_index
+
+
+def get_tag_choices():
+    return tag_index.choices()
+
+
+class TagSlugField(fields.MultipleChoiceField):
+    """Слаги тегов, проверяемые по TagIndex, а при промахе - по БД."""
+
+    def validate(self, value):
+        if not value:
+            if self.required:
+                raise forms.ValidationError(
+                    self.error_messages['required'], code='required')
+            return
+        found = tag_index.get_ids(value)
+        for slug in value:
+            if slug not in found:
+                raise forms.ValidationError(
+                    self.error_messages['invalid_choice'],
+                    code='invalid_choice',
+                    params={'value': slug},
+                )
+
+
+class TagSlugFilter(filters.MultipleChoiceFilter):
+    field_class = TagSlugField
+
+
+class IntegerFilter(filters.NumberFilter):
+    field_class = forms.IntegerField
+
+
+class IdInFilter(filters.BaseInFilter, IntegerFilter):
+    """Список id через запятую."""
 
 
 class IngredientFilter(FilterSet):
@@ -15,10 +54,9 @@ class IngredientFilter(FilterSet):
 
 
 class RecipeFilter(FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    tags = TagSlugFilter(
+        choices=get_tag_choices,
+        method='filter_tags'
     )
     is_favorited = filters.BooleanFilter(
         method='filter_is_favorited'
@@ -26,10 +64,23 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
+    ingredients = IdInFilter(method='filter_ingredients')
+    exclude_ingredients = IdInFilter(method='filter_exclude_ingredients')
+    max_missing = IntegerFilter(method='filter_max_missing', min_value=0)
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart', 'search',
+            'ingredients', 'exclude_ingredients', 'max_missing'
+        )
+
+    def filter_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тегов, по Recipe.tags_mask."""
+        if not value:
+            return queryset
+        return queryset.with_any_tag(tag_index.get_ids(value).values())
 
     def filter_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
@@ -40,3 +91,33 @@ class RecipeFilter(FilterSet):
         if value and self.request.user.is_authenticated:
             return queryset.filter(shopping_carts__user=self.request.user)
         return queryset
+
+    def filter_search(self, queryset, name, value):
+        if value.strip():
+            return queryset.search(value)
+        return queryset
+
+    def filter_ingredients(self, queryset, name, value):
+        """
+        Без max_missing - рецепты со всеми ингредиентами value.
+        С max_missing - рецепты, которые можно приготовить из value,
+        докупив не больше max_missing ингредиентов.
+        """
+        if not value:
+            return queryset
+        max_missing = self.form.cleaned_data.get('max_missing')
+        if max_missing is None:
+            ids = recipe_ingredient_index.containing(value)
+        else:
+            ids = recipe_ingredient_index.cookable(value, max_missing)
+        return queryset.with_ids(ids)
+
+    def filter_exclude_ingredients(self, queryset, name, value):
+        if value:
+            return queryset.with_ids(
+                recipe_ingredient_index.containing_any(value), exclude=True)
+        return queryset
+
+    def filter_max_missing(self, queryset, name, value):
+        """Учитывается в filter_ingredients."""
+        return queryset
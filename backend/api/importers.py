@@ -0,0 +1,180 @@
+"""
+Потоковая загрузка справочников (ингредиентов и тегов).
+
+Файл CSV или JSON читается порциями фиксированного размера, каждая
+порция сверяется с БД по естественному ключу и записывается одним
+upsert, поэтому память не зависит от размера файла, а повторная
+загрузка того же файла ничего не меняет.
+"""
+import csv
+import json
+import os
+from collections import Counter
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, transaction
+
+from recipes.versions import bump_version
+
+READ_SIZE = 64 * 1024
+
+
+def iter_json(file):
+    """
+    Объекты из JSON-массива или из JSON Lines, без загрузки
+    всего файла в память.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        chunk = file.read(READ_SIZE)
+        buffer = (buffer + chunk).lstrip(' \t\r\n,[]')
+        while buffer:
+            try:
+                value, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break
+            yield value
+            buffer = buffer[end:].lstrip(' \t\r\n,]')
+        if not chunk:
+            return
+
+
+def read_rows(path, fields):
+    """Строки файла path как словари с ключами fields, с номерами."""
+    with open(path, encoding='utf-8-sig') as file:
+        if os.path.splitext(path)[1].lower() == '.json':
+            yield from enumerate(iter_json(file), 1)
+            return
+        for number, row in enumerate(csv.reader(file), 1):
+            if not row or (number == 1 and tuple(row) == tuple(fields)):
+                continue
+            yield number, dict(zip(fields, row))
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class CatalogImportCommand(BaseCommand):
+    """
+    Основа команд загрузки справочников. Наследник задаёт model,
+    порядок колонок CSV columns, ключевые поля key_fields, обновляемые
+    поля value_fields, файл по умолчанию default_path и версию данных
+    data_version.
+    """
+    model = None
+    columns = ()
+    key_fields = ()
+    value_fields = ()
+    default_path = None
+    data_version = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=self.default_path,
+            help='CSV или JSON файл (по умолчанию %(default)s)'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Сколько строк сверять и записывать за раз'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только посчитать изменения, ничего не записывая'
+        )
+
+    def get_key(self, obj):
+        return tuple(getattr(obj, field) for field in self.key_fields)
+
+    def build(self, chunk):
+        """Проверенные объекты порции по ключу; дубли - последний."""
+        objects = {}
+        for number, row in chunk:
+            try:
+                obj = self.model(**{
+                    field: row[field]
+                    for field in self.key_fields + self.value_fields
+                })
+                obj.clean_fields()
+            except (KeyError, TypeError, ValidationError) as error:
+                self.report(number, error)
+                continue
+            objects[self.get_key(obj)] = obj
+        return objects
+
+    def upsert(self, chunk, dry_run):
+        objects = self.build(chunk)
+        if not objects:
+            return Counter()
+        first = self.key_fields[0]
+        existing = {
+            self.get_key(obj): obj
+            for obj in self.model.objects.filter(**{
+                f'{first}__in': {getattr(obj, first)
+                                 for obj in objects.values()}
+            })
+        }
+        counts = Counter()
+        to_write = []
+        for key, obj in objects.items():
+            if key not in existing:
+                counts['inserted'] += 1
+            elif any(getattr(obj, field) != getattr(existing[key], field)
+                     for field in self.value_fields):
+                counts['updated'] += 1
+            else:
+                counts['unchanged'] += 1
+                continue
+            to_write.append(obj)
+        if dry_run or not to_write:
+            return counts
+        options = {'ignore_conflicts': True}
+        if self.value_fields:
+            options = {
+                'update_conflicts': True,
+                'unique_fields': self.key_fields,
+                'update_fields': self.value_fields,
+            }
+        try:
+            with transaction.atomic():
+                self.model.objects.bulk_create(to_write, **options)
+        except IntegrityError as error:
+            self.report(f'{chunk[0][0]}-{chunk[-1][0]}', error)
+            return Counter(unchanged=counts['unchanged'])
+        return counts
+
+    def report(self, number, error):
+        self.errors += 1
+        self.stdout.write(self.style.ERROR(f'Строка {number}: {error}'))
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            self.stdout.write(self.style.ERROR(f'"{path}" не найден'))
+            return
+        self.errors = 0
+        counts = Counter()
+        try:
+            for chunk in chunked(
+                    read_rows(path, self.columns),
+                    options['chunk_size']):
+                counts += self.upsert(chunk, options['dry_run'])
+        except (OSError, ValueError, csv.Error) as error:
+            self.stdout.write(self.style.ERROR(
+                f'Ошибка при обработке файла: {error}'))
+            return
+        if (counts['inserted'] or counts['updated']) and not options[
+                'dry_run']:
+            bump_version(self.data_version)
+        verb = 'Будет добавлено' if options['dry_run'] else 'Добавлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb}: {counts["inserted"]}, обновлено: {counts["updated"]}, '
+            f'без изменений: {counts["unchanged"]}, ошибок: {self.errors}'
+        ))
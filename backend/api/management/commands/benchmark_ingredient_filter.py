@@ -0,0 +1,160 @@
+import random
+import time
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, Q
+
+from api.importers import chunked
+from api.search import RecipeIngredientIndex
+from recipes.models import Ingredient, Recipe, RecipeIngredient
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает фильтры рецептов по ингредиентам через индекс в памяти '
+        'и через запросы к БД на синтетических данных. Данные создаются '
+        'в транзакции, которая затем откатывается'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, nargs='+',
+            default=[10_000, 100_000, 1_000_000],
+            help='Размеры таблицы RecipeIngredient'
+        )
+        parser.add_argument(
+            '--per-recipe', type=int, default=10,
+            help='Ингредиентов в рецепте'
+        )
+        parser.add_argument(
+            '--queries', type=int, default=20,
+            help='Запросов каждого вида на размер'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Начальное значение генератора случайных чисел'
+        )
+
+    def generate(self, rows, per_recipe, ingredient_ids, rng):
+        """Рецепты, ингредиенты которых выбраны по закону Ципфа."""
+        author, _ = User.objects.get_or_create(
+            username='benchmark', defaults={'email': 'benchmark@example.com'})
+        weights = list(accumulate(
+            1 / rank for rank in range(1, len(ingredient_ids) + 1)))
+        recipe_ids = []
+        for batch in chunked(range(rows // per_recipe), 10000):
+            recipe_ids += [recipe.pk for recipe in Recipe.objects.bulk_create(
+                Recipe(
+                    author=author, name=f'Рецепт {number}', text='-',
+                    cooking_time=1, image='recipes/images/benchmark.png'
+                ) for number in batch
+            )]
+        items = (
+            RecipeIngredient(
+                recipe_id=recipe_id, ingredient_id=ingredient_id, amount=1)
+            for recipe_id in recipe_ids
+            for ingredient_id in self.sample(
+                ingredient_ids, weights, per_recipe, rng)
+        )
+        for batch in chunked(items, 10000):
+            RecipeIngredient.objects.bulk_create(batch)
+
+    def sample(self, ingredient_ids, weights, size, rng):
+        chosen = set()
+        while len(chosen) < size:
+            chosen.update(rng.choices(
+                ingredient_ids, cum_weights=weights, k=size - len(chosen)))
+        return chosen
+
+    def measure(self, function, arguments):
+        """Среднее время в мс и результаты function на arguments."""
+        started = time.perf_counter()
+        results = [function(*item) for item in arguments]
+        elapsed = (time.perf_counter() - started) * 1000 / len(arguments)
+        return elapsed, results
+
+    def page(self, queryset):
+        """То, что запрашивает API: число рецептов и первая страница."""
+        return queryset.count(), list(queryset.values_list(
+            'id', flat=True)[:settings.DEFAULT_PAGE_SIZE])
+
+    def run(self, rows, options, ingredient_ids, rng):
+        started = time.perf_counter()
+        self.generate(rows, options['per_recipe'], ingredient_ids, rng)
+        generated = time.perf_counter() - started
+        index = RecipeIngredientIndex()
+        started = time.perf_counter()
+        index.load()
+        built = time.perf_counter() - started
+        self.stdout.write(
+            f'\nRecipeIngredient: {RecipeIngredient.objects.count()}, '
+            f'генерация {generated:.1f} с, сборка индекса {built:.2f} с'
+        )
+        popular = ingredient_ids[:50]
+        cases = {
+            'все из 2': (
+                [(rng.sample(popular, 2),) for _ in range(options['queries'])],
+                lambda ids: self.page(
+                    Recipe.objects.with_ids(index.containing(ids))),
+                lambda ids: self.page(self.orm_containing(ids)),
+            ),
+            'без 3': (
+                [(rng.sample(popular, 3),) for _ in range(options['queries'])],
+                lambda ids: self.page(Recipe.objects.with_ids(
+                    index.containing_any(ids), exclude=True)),
+                lambda ids: self.page(
+                    Recipe.objects.exclude(ingredients__ingredient__in=ids)),
+            ),
+            'из 30, не хватает <= 2': (
+                [(rng.sample(ingredient_ids[:200], 30), 2)
+                 for _ in range(options['queries'])],
+                lambda ids, missing: self.page(
+                    Recipe.objects.with_ids(index.cookable(ids, missing))),
+                lambda ids, missing: self.page(
+                    self.orm_cookable(ids, missing)),
+            ),
+        }
+        for name, (arguments, with_index, with_orm) in cases.items():
+            index_time, index_results = self.measure(with_index, arguments)
+            orm_time, orm_results = self.measure(with_orm, arguments)
+            same = [count for count, _ in index_results] == [
+                count for count, _ in orm_results]
+            self.stdout.write(
+                f'  {name}: индекс {index_time:.1f} мс, '
+                f'БД {orm_time:.1f} мс, '
+                f'найдено в среднем '
+                f'{sum(count for count, _ in index_results) // len(arguments)}'
+                f'{"" if same else ", РЕЗУЛЬТАТЫ РАЗЛИЧАЮТСЯ"}'
+            )
+
+    def orm_containing(self, ingredient_ids):
+        queryset = Recipe.objects.all()
+        for ingredient_id in ingredient_ids:
+            queryset = queryset.filter(ingredients__ingredient=ingredient_id)
+        return queryset
+
+    def orm_cookable(self, ingredient_ids, max_missing):
+        return Recipe.objects.annotate(
+            missing=Count('ingredients', filter=~Q(
+                ingredients__ingredient__in=ingredient_ids))
+        ).filter(missing__lte=max_missing)
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(
+            Ingredient.objects.order_by('id').values_list('id', flat=True))
+        if len(ingredient_ids) < max(options['per_recipe'], 200):
+            raise CommandError(
+                'Нужно не меньше 200 ингредиентов: '
+                'выполните import_ingredients')
+        rng = random.Random(options['seed'])
+        rng.shuffle(ingredient_ids)
+        for rows in options['rows']:
+            with transaction.atomic():
+                self.run(rows, options, ingredient_ids, rng)
+                transaction.set_rollback(True)
@@ -0,0 +1,90 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.search import ingredient_index
+from recipes.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск ингредиентов через индекс в памяти и через ORM'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Сколько раз повторить каждый запрос'
+        )
+        parser.add_argument(
+            '--prefix-length', type=int, default=3,
+            help='Длина префикса, взятого из названий ингредиентов'
+        )
+
+    def measure(self, search, queries, repeat):
+        timings = []
+        for query in queries:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                search(query)
+                timings.append((time.perf_counter() - start) * 10 ** 6)
+        timings.sort()
+        return (
+            statistics.mean(timings),
+            timings[len(timings) // 2],
+            timings[int(len(timings) * 0.95)],
+        )
+
+    def report(self, name, search, queries, repeat):
+        mean, median, p95 = self.measure(search, queries, repeat)
+        self.stdout.write(
+            f'{name:>14}: среднее {mean:9.1f} мкс, '
+            f'медиана {median:9.1f} мкс, p95 {p95:9.1f} мкс'
+        )
+
+    def handle(self, *args, **options):
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+        repeat = options['repeat']
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            self.stdout.write(self.style.ERROR('Нет ингредиентов'))
+            return
+        prefixes = sorted({name[:options['prefix_length']] for name in names})
+        typos = [
+            name[:len(name) // 2] + 'а' + name[len(name) // 2 + 1:]
+            for name in names[::10]
+        ]
+        middles = [name[len(name) // 3:] for name in names[::10]]
+        ingredient_index.load()
+        self.stdout.write(
+            f'{len(names)} ингредиентов, {len(prefixes)} префиксов, '
+            f'{len(typos)} запросов с опечаткой, {repeat} повторов, '
+            f'limit={limit}'
+        )
+        self.report(
+            'index prefix',
+            lambda query: ingredient_index.startswith(query, limit),
+            prefixes, repeat
+        )
+        self.report(
+            'orm prefix',
+            lambda query: list(Ingredient.objects.filter(
+                name__istartswith=query)[:limit]),
+            prefixes, repeat
+        )
+        self.report(
+            'index typo',
+            lambda query: ingredient_index.search(query, limit),
+            typos, repeat
+        )
+        self.report(
+            'index middle',
+            lambda query: ingredient_index.search(query, limit),
+            middles, repeat
+        )
+        self.report(
+            'orm middle',
+            lambda query: list(Ingredient.objects.filter(
+                name__icontains=query)[:limit]),
+            middles, repeat
+        )
@@ -0,0 +1,59 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.importers import chunked
+from recipes import similarity
+from recipes.models import SimilarRecipe
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает таблицу похожих рецептов (MinHash/LSH)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--limit', type=int, default=settings.SIMILAR_RECIPES_LIMIT,
+            help='Сколько похожих рецептов хранить для каждого'
+        )
+        parser.add_argument(
+            '--min-score', type=float, default=settings.SIMILAR_MIN_SCORE,
+            help='Минимальный коэффициент Жаккара'
+        )
+        parser.add_argument(
+            '--permutations', type=int,
+            default=settings.MINHASH_PERMUTATIONS,
+            help='Длина MinHash-подписи'
+        )
+        parser.add_argument(
+            '--bands', type=int, default=settings.MINHASH_BANDS,
+            help='Число полос LSH (делитель длины подписи)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Сколько строк записывать за раз'
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        neighbours = similarity.build(
+            options['limit'], options['min_score'],
+            options['permutations'], options['bands']
+        )
+        built = time.monotonic()
+        rows = (
+            SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                          score=score)
+            for recipe_id, items in neighbours.items()
+            for score, similar_id in items
+        )
+        with transaction.atomic():
+            SimilarRecipe.objects.all().delete()
+            for batch in chunked(rows, options['batch_size']):
+                SimilarRecipe.objects.bulk_create(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов с соседями: {len(neighbours)}, '
+            f'поиск {built - started:.1f} с, '
+            f'запись {time.monotonic() - built:.1f} с'
+        ))
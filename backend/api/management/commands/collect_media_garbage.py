@@ -0,0 +1,80 @@
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import Recipe
+from recipes.renditions import get_rendition_name
+
+User = get_user_model()
+
+MEDIA_FIELDS = (
+    (Recipe, 'image', settings.RECIPE_IMAGE_RENDITIONS),
+    (User, 'avatar', settings.AVATAR_RENDITIONS),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из хранилища изображения рецептов и аватары, на которые '
+        'не ссылается ни одна запись, вместе с их вариантами'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено'
+        )
+        parser.add_argument(
+            '--grace', type=int, default=60 * 60,
+            help=(
+                'Не трогать файлы моложе стольких секунд: их запись '
+                'в БД может быть ещё не сохранена'
+            )
+        )
+
+    def get_referenced(self, model, field, renditions):
+        referenced = set()
+        names = model.objects.exclude(
+            **{f'{field}__isnull': True}
+        ).exclude(**{field: ''}).values_list(field, flat=True).iterator()
+        for name in names:
+            referenced.add(name)
+            referenced.update(
+                get_rendition_name(name, kind) for kind in renditions)
+        return referenced
+
+    def walk(self, directory):
+        directories, files = default_storage.listdir(directory)
+        for name in files:
+            yield os.path.join(directory, name)
+        for name in directories:
+            yield from self.walk(os.path.join(directory, name))
+
+    def handle(self, *args, **options):
+        deadline = timezone.now() - timedelta(seconds=options['grace'])
+        removed = freed = 0
+        for model, field, renditions in MEDIA_FIELDS:
+            directory = model._meta.get_field(field).upload_to
+            if not default_storage.exists(directory):
+                continue
+            referenced = self.get_referenced(model, field, renditions)
+            for name in self.walk(directory):
+                if (name in referenced
+                        or default_storage.get_modified_time(name)
+                        > deadline):
+                    continue
+                removed += 1
+                freed += default_storage.size(name)
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    default_storage.delete(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Будет удалено" if options["dry_run"] else "Удалено"} '
+            f'файлов: {removed}, {freed / 1024 / 1024:.1f} МБ'
+        ))
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.renditions import create_renditions, mark_renditions_ready
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие варианты изображений рецептов и аватаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересоздать и уже существующие варианты'
+        )
+
+    def process(self, queryset, field, renditions, force):
+        created = failed = 0
+        for instance in queryset.exclude(**{field: ''}).only(
+                'pk', field).iterator():
+            try:
+                created += len(create_renditions(
+                    getattr(instance, field), renditions, force))
+                mark_renditions_ready(instance, field)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(
+                    f'{queryset.model._meta.model_name} {instance.pk}: '
+                    f'{error}'
+                )
+        return created, failed
+
+    def handle(self, *args, **options):
+        for queryset, field, renditions in (
+            (Recipe.objects.all(), 'image', settings.RECIPE_IMAGE_RENDITIONS),
+            (User.objects.filter(avatar__isnull=False), 'avatar',
+             settings.AVATAR_RENDITIONS),
+        ):
+            created, failed = self.process(
+                queryset, field, renditions, options['force'])
+            self.stdout.write(
+                f'{queryset.model._meta.model_name}.{field}: '
+                f'создано {created}, ошибок {failed}'
+            )
+        self.stdout.write(self.style.SUCCESS('Готово'))
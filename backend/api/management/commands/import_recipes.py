@@ -0,0 +1,279 @@
+import base64
+import binascii
+import csv
+import io
+import json
+import os
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+
+from recipes.constants import (
+    MAX_COOKTIME_VAL, MAX_LENGTH_NAME_RECIPE, MAX_LENGTH_TEXT,
+    MIN_AMOUNT_VAL, MIN_COOKING_TIME
+)
+from recipes.models import (
+    Ingredient, Recipe, RecipeIngredient, Tag, get_tags_mask
+)
+from recipes.tasks import create_recipe_image_renditions, fan_out_recipes
+from recipes.versions import RECIPE_INGREDIENTS_VERSION, bump_version
+
+User = get_user_model()
+
+IMAGE_UPLOAD_TO = Recipe._meta.get_field('image').upload_to
+
+
+class RowError(ValueError):
+    pass
+
+
+def copy_rows(model, fields, rows):
+    """Загружает строки в таблицу model через COPY (только PostgreSQL)."""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    columns = ', '.join(
+        connection.ops.quote_name(model._meta.get_field(field).column)
+        for field in fields
+    )
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f'COPY {connection.ops.quote_name(model._meta.db_table)} '
+            f'({columns}) FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует рецепты из JSONL файла: по объекту на строку с полями '
+        'author (username), name, text, cooking_time, image (путь к файлу '
+        'или data:-URI), tags (слаги) и ingredients '
+        '([{name, measurement_unit, amount}])'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к JSONL файлу')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Сколько рецептов записывать за раз'
+        )
+
+    def load_authors(self, usernames):
+        missing = set(usernames) - self.authors.keys()
+        if missing:
+            self.authors.update(User.objects.filter(
+                username__in=missing
+            ).values_list('username', 'id'))
+            self.authors.update(dict.fromkeys(missing - self.authors.keys()))
+
+    def get_image(self, value):
+        """Имя файла изображения в хранилище; одинаковые берутся из кэша."""
+        if value in self.images:
+            return self.images[value]
+        if value.startswith('data:'):
+            try:
+                header, data = value.split(';base64,')
+                content = ContentFile(
+                    base64.b64decode(data),
+                    name='image.' + header.split('/')[-1]
+                )
+            except (ValueError, binascii.Error):
+                raise RowError('image: некорректный data:-URI')
+            name = default_storage.save(
+                os.path.join(IMAGE_UPLOAD_TO, content.name), content)
+        else:
+            path = os.path.join(self.base_dir, value)
+            if not os.path.isfile(path):
+                raise RowError(f'image: файл {value} не найден')
+            with open(path, 'rb') as source:
+                name = default_storage.save(
+                    os.path.join(IMAGE_UPLOAD_TO, os.path.basename(path)),
+                    File(source)
+                )
+        self.images[value] = name
+        return name
+
+    def parse(self, data):
+        """Проверяет строку и возвращает рецепт, id тегов и ингредиенты."""
+        if not isinstance(data, dict):
+            raise RowError('ожидается объект')
+        try:
+            author = data['author']
+            name, text = data['name'], data['text']
+            cooking_time = data['cooking_time']
+            image = data['image']
+            slugs = data['tags']
+            ingredients = data['ingredients']
+        except KeyError as error:
+            raise RowError(f'нет поля {error}')
+        author_id = self.authors.get(author) if isinstance(
+            author, str) else None
+        if author_id is None:
+            raise RowError(f'автор {author} не найден')
+        if not isinstance(name, str) or not 0 < len(
+                name) <= MAX_LENGTH_NAME_RECIPE:
+            raise RowError('name: пустое или слишком длинное')
+        if not isinstance(text, str) or not 0 < len(text) <= MAX_LENGTH_TEXT:
+            raise RowError('text: пустой или слишком длинный')
+        if not isinstance(cooking_time, int) or not (
+                MIN_COOKING_TIME <= cooking_time <= MAX_COOKTIME_VAL):
+            raise RowError('cooking_time: вне допустимого диапазона')
+        if not slugs or not isinstance(slugs, list):
+            raise RowError('tags: нужен хотя бы один тег')
+        unknown = [slug for slug in slugs if slug not in self.tags]
+        if unknown:
+            raise RowError(f'tags: неизвестные теги {unknown}')
+        if not ingredients or not isinstance(ingredients, list):
+            raise RowError('ingredients: нужен хотя бы один ингредиент')
+        amounts = {}
+        for item in ingredients:
+            try:
+                key = (item['name'], item['measurement_unit'])
+                amount = item['amount']
+            except (KeyError, TypeError):
+                raise RowError(
+                    'ingredients: нужны name, measurement_unit и amount')
+            if key not in self.ingredients:
+                raise RowError(f'ingredients: неизвестный ингредиент {key}')
+            if not isinstance(amount, int) or amount < MIN_AMOUNT_VAL:
+                raise RowError(f'ingredients: неверное количество {key}')
+            if self.ingredients[key] in amounts:
+                raise RowError(f'ingredients: повтор {key}')
+            amounts[self.ingredients[key]] = amount
+        if not isinstance(image, str):
+            raise RowError('image: ожидается строка')
+        tag_ids = {self.tags[slug] for slug in slugs}
+        recipe = Recipe(
+            author_id=author_id,
+            name=name,
+            text=text,
+            cooking_time=cooking_time,
+            image=self.get_image(image),
+            tags_mask=get_tags_mask(tag_ids),
+        )
+        return recipe, tag_ids, amounts
+
+    def write(self, parsed):
+        """Записывает проверенные рецепты одной транзакцией."""
+        recipes = Recipe.objects.bulk_create(
+            [recipe for recipe, _, _ in parsed])
+        tag_rows = [
+            (recipe.pk, tag_id)
+            for recipe, tag_ids, _ in parsed for tag_id in tag_ids
+        ]
+        ingredient_rows = [
+            (recipe.pk, ingredient_id, amount)
+            for recipe, _, amounts in parsed
+            for ingredient_id, amount in amounts.items()
+        ]
+        through = Recipe.tags.through
+        if connection.vendor == 'postgresql':
+            copy_rows(through, ('recipe', 'tag'), tag_rows)
+            copy_rows(
+                RecipeIngredient, ('recipe', 'ingredient', 'amount'),
+                ingredient_rows
+            )
+        else:
+            through.objects.bulk_create(
+                through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id, tag_id in tag_rows
+            )
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=amount
+                )
+                for recipe_id, ingredient_id, amount in ingredient_rows
+            )
+        per_author = Counter(recipe.author_id for recipe in recipes)
+        for author_id, count in per_author.items():
+            User.objects.filter(pk=author_id).update(
+                recipes_count=F('recipes_count') + count)
+        recipe_ids = [recipe.pk for recipe in recipes]
+        create_recipe_image_renditions.delay(*recipe_ids)
+        fan_out_recipes.delay(*recipe_ids)
+        return len(recipes)
+
+    def process(self, chunk):
+        self.load_authors(
+            data.get('author') for _, data in chunk
+            if isinstance(data, dict) and isinstance(data.get('author'), str)
+        )
+        parsed = []
+        parsed_lines = []
+        for line_number, data in chunk:
+            try:
+                parsed.append(self.parse(data))
+            except RowError as error:
+                self.report(line_number, error)
+            else:
+                parsed_lines.append(line_number)
+        if not parsed:
+            return 0
+        try:
+            with transaction.atomic():
+                return self.write(parsed)
+        except DatabaseError as error:
+            for line_number in parsed_lines:
+                self.report(line_number, f'пакет не записан: {error}')
+            return 0
+
+    def report(self, line_number, error):
+        self.failed += 1
+        self.stderr.write(f'Строка {line_number}: {error}')
+
+    def read(self, source, chunk_size):
+        chunk = []
+        for line_number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                chunk.append((line_number, json.loads(line)))
+            except json.JSONDecodeError as error:
+                self.report(line_number, f'некорректный JSON: {error}')
+                continue
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.isfile(path):
+            raise CommandError(f'Файл "{path}" не найден')
+        self.base_dir = os.path.dirname(os.path.abspath(path))
+        self.authors = {}
+        self.images = {}
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.ingredients = {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit').iterator()
+        }
+        self.failed = 0
+        created = 0
+        started = time.monotonic()
+        with open(path, encoding='utf-8') as source:
+            for chunk in self.read(source, options['chunk_size']):
+                created += self.process(chunk)
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f'Импортировано {created}, ошибок {self.failed}, '
+                    f'{created / max(elapsed, 0.001):.0f} рецептов/с'
+                )
+        if created:
+            bump_version(RECIPE_INGREDIENTS_VERSION)
+        style = self.style.ERROR if self.failed else self.style.SUCCESS
+        self.stdout.write(style(
+            f'Импортировано рецептов: {created}, ошибок: {self.failed} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
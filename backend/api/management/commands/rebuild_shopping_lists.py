@@ -0,0 +1,82 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import ShoppingCart, ShoppingListItem
+from recipes.versions import bump_shopping_cart_versions
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет сводные списки покупок с корзинами и рецептами '
+        'и исправляет расхождения'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить, ничего не изменяя'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько пользователей обрабатывать за раз'
+        )
+
+    def get_user_batches(self, batch_size):
+        user_ids = sorted(
+            set(ShoppingCart.objects.values_list('user_id', flat=True))
+            | set(ShoppingListItem.objects.values_list('user_id', flat=True))
+        )
+        for start in range(0, len(user_ids), batch_size):
+            yield user_ids[start:start + batch_size]
+
+    def handle(self, *args, **options):
+        checked = missing = wrong = extra = 0
+        for user_ids in self.get_user_batches(options['batch_size']):
+            live = {
+                (user_id, ingredient_id): total_amount
+                for user_id, ingredient_id, total_amount
+                in ShoppingListItem.objects.live_totals(user_ids)
+            }
+            stored = {
+                (user_id, ingredient_id): total_amount
+                for user_id, ingredient_id, total_amount
+                in ShoppingListItem.objects.filter(
+                    user__in=user_ids
+                ).values_list('user_id', 'ingredient_id', 'total_amount')
+            }
+            broken = set()
+            for key, total_amount in live.items():
+                if key not in stored:
+                    missing += 1
+                    broken.add(key)
+                elif stored[key] != total_amount:
+                    wrong += 1
+                    broken.add(key)
+            for key in stored.keys() - live.keys():
+                extra += 1
+                broken.add(key)
+            checked += len(user_ids)
+            if broken and not options['check']:
+                broken_user_ids = {user_id for user_id, _ in broken}
+                with transaction.atomic():
+                    ShoppingListItem.objects.refresh(
+                        broken_user_ids,
+                        {ingredient_id for _, ingredient_id in broken}
+                    )
+                    transaction.on_commit(partial(
+                        bump_shopping_cart_versions, broken_user_ids))
+        self.stdout.write(
+            f'Пользователей: {checked}, нет строк: {missing}, '
+            f'неверная сумма: {wrong}, лишних строк: {extra}'
+        )
+        if not missing + wrong + extra:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+        elif options['check']:
+            self.stdout.write(self.style.ERROR('Найдены расхождения'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Расхождения исправлены'))
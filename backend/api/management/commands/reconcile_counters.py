@@ -0,0 +1,80 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favourite, Recipe, ShoppingCart
+from users.models import Follower
+
+User = get_user_model()
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favourite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipes'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Follower, 'follow'),
+)
+
+
+def count_related(model, field):
+    """Подзапрос с числом строк model, ссылающихся на объект через field."""
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счётчики рецептов и пользователей и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только проверить, ничего не изменяя'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк проверять за раз'
+        )
+
+    def reconcile(self, model, counter, related_model, field, options):
+        fixed = 0
+        last_pk = 0
+        while True:
+            batch = list(model.objects.filter(
+                pk__gt=last_pk
+            ).order_by('pk').values_list(
+                'pk', flat=True
+            )[:options['batch_size']])
+            if not batch:
+                return fixed
+            last_pk = batch[-1]
+            drifted = model.objects.filter(pk__in=batch).annotate(
+                actual=count_related(related_model, field)
+            ).exclude(**{counter: F('actual')}).values_list('pk', flat=True)
+            if options['check']:
+                fixed += drifted.count()
+                continue
+            with transaction.atomic():
+                fixed += model.objects.filter(
+                    pk__in=list(drifted)
+                ).update(**{counter: count_related(related_model, field)})
+
+    def handle(self, *args, **options):
+        total = 0
+        for model, counter, related_model, field in COUNTERS:
+            fixed = self.reconcile(
+                model, counter, related_model, field, options)
+            total += fixed
+            self.stdout.write(
+                f'{model._meta.model_name}.{counter}: расхождений {fixed}')
+        if not total:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+        elif options['check']:
+            self.stdout.write(self.style.ERROR('Найдены расхождения'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Расхождения исправлены'))
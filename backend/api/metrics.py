@@ -0,0 +1,253 @@
+"""
+Метрики обработки запросов в текстовом формате Prometheus.
+
+MetricsMiddleware для каждого запроса записывает в гистограммы время
+ответа, число и суммарное время запросов к БД и размер ответа с
+метками route (вьюсет и действие DRF), method и status (класс кода).
+Значения копятся в словарях своего потока, без блокировок.
+
+С несколькими процессами gunicorn каждый процесс раз в
+METRICS_FLUSH_INTERVAL секунд сохраняет свои значения в файл
+в общем каталоге METRICS_DIR, а /metrics суммирует файлы всех
+процессов. Файлы завершившихся процессов остаются: счётчики
+гистограмм не уменьшаются при перезапуске воркеров. Без METRICS_DIR
+отдаются значения только текущего процесса.
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import ExitStack
+from uuid import uuid4
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+PREFIX = 'foodgram_'
+LABELS = ('route', 'method', 'status')
+HISTOGRAMS = {
+    'http_request_duration_seconds': (
+        'Время обработки запроса', settings.METRICS_LATENCY_BUCKETS),
+    'http_db_queries': (
+        'Запросов к БД за запрос', settings.METRICS_QUERY_BUCKETS),
+    'http_db_duration_seconds': (
+        'Время запросов к БД за запрос', settings.METRICS_LATENCY_BUCKETS),
+    'http_response_size_bytes': (
+        'Размер ответа', settings.METRICS_SIZE_BUCKETS),
+}
+
+_local = threading.local()
+_thread_series = []
+_file = {'pid': None, 'path': None, 'flushed': 0.0}
+
+
+def observe(name, labels, value):
+    """Добавляет value в гистограмму name с метками labels."""
+    series = getattr(_local, 'series', None)
+    if series is None:
+        series = _local.series = {}
+        _thread_series.append(series)
+    values = series.get((name, labels))
+    buckets = HISTOGRAMS[name][1]
+    if values is None:
+        # Счётчики корзин, последняя - +Inf, и сумма значений.
+        values = series[name, labels] = [0] * (len(buckets) + 2)
+    values[bisect_left(buckets, value)] += 1
+    values[-1] += value
+
+
+def merge(target, items):
+    for key, values in items:
+        if key in target:
+            target[key] = [
+                total + value for total, value in zip(target[key], values)]
+        else:
+            target[key] = list(values)
+    return target
+
+
+def snapshot():
+    """Значения всех потоков процесса."""
+    result = {}
+    for series in list(_thread_series):
+        merge(result, list(series.items()))
+    return result
+
+
+def get_path():
+    """Файл процесса в METRICS_DIR; после fork у процесса новый файл."""
+    if _file['pid'] != os.getpid():
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        _file.update(
+            pid=os.getpid(),
+            path=os.path.join(
+                settings.METRICS_DIR, f'{os.getpid()}-{uuid4().hex}.json')
+        )
+    return _file['path']
+
+
+def flush():
+    """Сохраняет значения процесса в его файл в METRICS_DIR."""
+    path = get_path()
+    _file['flushed'] = time.monotonic()
+    temporary = f'{path}.{threading.get_ident()}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump([
+            [name, labels, values]
+            for (name, labels), values in snapshot().items()
+        ], file)
+    os.replace(temporary, path)
+
+
+def collect():
+    """Значения всех процессов: из файлов METRICS_DIR или из памяти."""
+    if not settings.METRICS_DIR:
+        return snapshot()
+    flush()
+    result = {}
+    for name in os.listdir(settings.METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name)) as file:
+                items = json.load(file)
+        except (OSError, ValueError):
+            continue
+        merge(result, (
+            ((metric, tuple(labels)), values)
+            for metric, labels, values in items
+            if metric in HISTOGRAMS
+        ))
+    return result
+
+
+def format_labels(labels, **extra):
+    pairs = list(zip(LABELS, labels)) + list(extra.items())
+    return ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', r'\\').replace(
+            '"', r'\"').replace('\n', r'\n'))
+        for key, value in pairs
+    )
+
+
+def render(series):
+    """Гистограммы в текстовом формате Prometheus."""
+    by_name = defaultdict(list)
+    for (name, labels), values in sorted(series.items()):
+        by_name[name].append((labels, values))
+    lines = []
+    for name, items in by_name.items():
+        description, buckets = HISTOGRAMS[name]
+        metric = PREFIX + name
+        lines += [
+            f'# HELP {metric} {description}',
+            f'# TYPE {metric} histogram',
+        ]
+        for labels, values in items:
+            total = 0
+            for bound, count in zip(buckets + ('+Inf',), values):
+                total += count
+                lines.append(
+                    f'{metric}_bucket{{{format_labels(labels, le=bound)}}} '
+                    f'{total}'
+                )
+            lines.append(f'{metric}_sum{{{format_labels(labels)}}} '
+                         f'{values[-1]}')
+            lines.append(f'{metric}_count{{{format_labels(labels)}}} {total}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics(request):
+    return HttpResponse(
+        render(collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+class QueryTimer:
+    """Обёртка execute_wrapper, считающая запросы к БД и их время."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """Записывает метрики каждого запроса, см. модуль."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        cls = getattr(view_func, 'cls', None)
+        actions = getattr(view_func, 'actions', None)
+        method = request.method.lower()
+        if actions:
+            request.metrics_route = (
+                f'{cls.__name__}.{actions.get(method, method)}')
+        elif cls is not None:
+            request.metrics_route = f'{cls.__name__}.{method}'
+        else:
+            request.metrics_route = request.resolver_match.view_name
+
+    def track(self, timer):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        return stack
+
+    def record(self, request, response, started, timer, size):
+        labels = (
+            getattr(request, 'metrics_route', 'unresolved'),
+            request.method,
+            f'{response.status_code // 100}xx',
+        )
+        observe('http_request_duration_seconds', labels,
+                time.perf_counter() - started)
+        observe('http_db_queries', labels, timer.count)
+        observe('http_db_duration_seconds', labels, timer.duration)
+        observe('http_response_size_bytes', labels, size)
+        if settings.METRICS_DIR and (
+                time.monotonic() - _file['flushed']
+                >= settings.METRICS_FLUSH_INTERVAL):
+            flush()
+
+    def stream(self, request, response, started, timer, content):
+        """
+        Потоковый ответ формируется уже после middleware: запросы
+        к БД и размер считаются, пока он отдаётся клиенту.
+        """
+        size = 0
+        try:
+            with self.track(timer):
+                for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+        finally:
+            self.record(request, response, started, timer, size)
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        timer = QueryTimer()
+        with self.track(timer):
+            response = self.get_response(request)
+        if response.streaming:
+            response.streaming_content = self.stream(
+                request, response, started, timer,
+                response.streaming_content
+            )
+        else:
+            self.record(
+                request, response, started, timer, len(response.content))
+        return response
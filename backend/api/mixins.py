@@ -0,0 +1,127 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.http import HttpResponse
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+
+from recipes.versions import get_version
+
+logger = logging.getLogger(__name__)
+
+
+class QueryCounter:
+    """Обёртка execute_wrapper, считающая запросы к БД."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryBudgetMixin:
+    """
+    Контроль числа запросов к БД на действие вьюсета.
+    В режиме DEBUG считает запросы, выполненные действием,
+    отдаёт их число в заголовке X-Query-Count и пишет
+    предупреждение, если превышен бюджет query_budget[action].
+    """
+    query_budget = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        if not settings.DEBUG:
+            return super().dispatch(request, *args, **kwargs)
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = super().dispatch(request, *args, **kwargs)
+        response['X-Query-Count'] = counter.count
+        budget = self.query_budget.get(getattr(self, 'action', None))
+        if budget is not None and counter.count > budget:
+            logger.warning(
+                'Превышен бюджет запросов для %s.%s: %d > %d',
+                type(self).__name__, self.action, counter.count, budget
+            )
+        return response
+
+
+class CursorPaginationMixin:
+    """
+    Курсорная пагинация по запросу клиента.
+    Если в запросе есть параметр cursor (для первой страницы - пустой),
+    вместо обычного пагинатора используется cursor_pagination_class.
+    Параметры cursor_ordering_params задают свой порядок выдачи, и с
+    ними остаётся обычная пагинация.
+    """
+    cursor_pagination_class = None
+    cursor_ordering_params = ()
+
+    def use_cursor_pagination(self):
+        params = self.request.query_params
+        return 'cursor' in params and not any(
+            params.get(name, '').strip()
+            for name in self.cursor_ordering_params
+        )
+
+    @property
+    def paginator(self):
+        if (self.cursor_pagination_class is None
+                or self.pagination_class is None
+                or not self.use_cursor_pagination()):
+            return super().paginator
+        if not isinstance(
+                getattr(self, '_paginator', None),
+                self.cursor_pagination_class):
+            self._paginator = self.cursor_pagination_class()
+        return self._paginator
+
+
+class VersionedCacheMixin:
+    """
+    Кэширование ответов справочников по версии данных data_version.
+    Сильный ETag считается из версии и адреса запроса без обращения
+    к данным, на If-None-Match с тем же ETag отдаётся 304. Тело
+    хранится в кэше процесса responses только для запросов без
+    параметров (полный список и отдельные объекты): ответы на
+    запросы с фильтрами строятся заново и в кэш не пишутся.
+    """
+    data_version = None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+        etag = '"{}"'.format(hashlib.sha1('{}:{}:{}'.format(
+            self.data_version,
+            get_version(self.data_version),
+            request.get_full_path()
+        ).encode()).hexdigest())
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+        key = f'response:{etag}'
+        cached = not request.query_params
+        body = caches['responses'].get(key) if cached else None
+        if body is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            body = JSONRenderer().render(response.data)
+            if cached:
+                caches['responses'].set(
+                    key, body, settings.RESPONSE_CACHE_TIMEOUT)
+        response = HttpResponse(body, content_type='application/json')
+        response['ETag'] = etag
+        return response
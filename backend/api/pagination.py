@@ -1,5 +1,5 @@
 from django.conf import settings
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class Pagination(PageNumberPagination):
@@ -11,3 +11,20 @@ class Pagination(PageNumberPagination):
     page_size = settings.DEFAULT_PAGE_SIZE
     max_page_size = settings.MAX_PAGE_SIZE
     page_size_query_param = 'limit'
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация ленты рецептов по (-created_at, -id).
+    Не считает COUNT(*) и не использует OFFSET по всей выборке,
+    поэтому дальние страницы стоят столько же, сколько первая.
+    """
+    page_size = settings.DEFAULT_PAGE_SIZE
+    max_page_size = settings.MAX_PAGE_SIZE
+    page_size_query_param = 'limit'
+    ordering = ('-created_at', '-id')
+
+
+class UserCursorPagination(RecipeCursorPagination):
+    """Курсорная пагинация пользователей и подписок по username."""
+    ordering = ('username',)
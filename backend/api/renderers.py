@@ -0,0 +1,23 @@
+from django.utils.encoding import smart_str
+from rest_framework.renderers import BaseRenderer
+
+
+class PlainTextRenderer(BaseRenderer):
+    """Текстовый формат выгрузки (format=txt)."""
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict):
+            data = '\n'.join(
+                f'{key}: {value}' for key, value in data.items())
+        return smart_str(data).encode(self.charset)
+
+
+class CSVRenderer(PlainTextRenderer):
+    """CSV формат выгрузки (format=csv)."""
+    media_type = 'text/csv'
+    format = 'csv'
@@ -0,0 +1,338 @@
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict, namedtuple
+
+from django.conf import settings
+
+from recipes.models import Ingredient, RecipeIngredient, Tag, get_tag_bit
+from recipes.versions import (
+    INGREDIENTS_VERSION, RECIPE_INGREDIENTS_VERSION, TAGS_VERSION,
+    get_changes, get_last_change, get_version, get_versions
+)
+
+from .bitmaps import Bitmap
+
+IndexData = namedtuple(
+    'IndexData', ('keys', 'ingredients', 'trigrams', 'postings'))
+RecipeIndexData = namedtuple(
+    'RecipeIndexData', ('recipes', 'postings', 'sizes'))
+
+
+def get_trigrams(text):
+    """Триграммы слов текста, как в pg_trgm: слово дополняется пробелами."""
+    trigrams = set()
+    for word in text.casefold().split():
+        word = f'  {word} '
+        trigrams.update(
+            word[position:position + 3]
+            for position in range(len(word) - 2)
+        )
+    return trigrams
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса.
+    Ингредиенты отсортированы по названию в нижнем регистре, поиск по
+    началу названия выполняется двоичным поиском без обращения к БД.
+    Для нечёткого поиска хранятся триграммы названий и обратный
+    индекс триграмма -> позиции ингредиентов.
+    Индекс строится при первом запросе и перестраивается, когда
+    меняется версия данных INGREDIENTS_VERSION.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = IndexData([], [], [], {})
+
+    def _build(self):
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda ingredient: (
+                ingredient.name.casefold(), ingredient.measurement_unit
+            )
+        )
+        keys = [ingredient.name.casefold() for ingredient in ingredients]
+        trigrams = [get_trigrams(key) for key in keys]
+        postings = {}
+        for position, key_trigrams in enumerate(trigrams):
+            for trigram in key_trigrams:
+                postings.setdefault(trigram, []).append(position)
+        return IndexData(keys, ingredients, trigrams, postings)
+
+    def load(self):
+        """Данные актуальной версии индекса."""
+        version = get_version(INGREDIENTS_VERSION)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self._data = self._build()
+                    self._version = version
+        return self._data
+
+    def all(self):
+        return self.load().ingredients
+
+    def startswith(self, prefix, limit=None):
+        """Ингредиенты, название которых начинается с prefix."""
+        keys, ingredients, _, _ = self.load()
+        prefix = prefix.casefold()
+        start = end = bisect_left(keys, prefix)
+        stop = len(keys) if limit is None else min(len(keys), start + limit)
+        while end < stop and keys[end].startswith(prefix):
+            end += 1
+        return ingredients[start:end]
+
+    def search(self, query, limit=None):
+        """
+        Поиск с опечатками.
+        Сначала совпадения по началу названия, затем по подстроке,
+        затем похожие по триграммам (не ниже TRIGRAM_SIMILARITY).
+        """
+        keys, ingredients, trigrams, postings = self.load()
+        query = ' '.join(query.casefold().split())
+        if not query:
+            return []
+        query_trigrams = get_trigrams(query)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(postings.get(trigram, ()))
+        if len(query) < 3:
+            candidates = range(len(keys))
+        else:
+            # Подстрока содержит все триграммы запроса без пробелов,
+            # а для похожести нужно не меньше TRIGRAM_SIMILARITY от
+            # триграмм запроса: остальные позиции можно не проверять.
+            threshold = min(
+                sum(' ' not in trigram for trigram in query_trigrams),
+                settings.TRIGRAM_SIMILARITY * len(query_trigrams)
+            )
+            candidates = [
+                position for position, common in shared.items()
+                if common >= threshold
+            ]
+        prefix_hits, substring_hits, fuzzy_hits = [], [], []
+        for position in candidates:
+            key = keys[position]
+            found = key.find(query)
+            if found == 0:
+                prefix_hits.append((key, position))
+            elif found > 0:
+                substring_hits.append((found, key, position))
+            else:
+                common = shared[position]
+                similarity = common / (
+                    len(query_trigrams) + len(trigrams[position]) - common)
+                if similarity >= settings.TRIGRAM_SIMILARITY:
+                    fuzzy_hits.append((-similarity, key, position))
+        ranked = sorted(prefix_hits) + sorted(substring_hits) + sorted(
+            fuzzy_hits)
+        return [ingredients[hit[-1]] for hit in ranked[:limit]]
+
+
+class RecipeIngredientIndex:
+    """
+    Обратный индекс ингредиент -> рецепты в памяти процесса.
+    Для каждого ингредиента хранится Bitmap id рецептов, где он есть,
+    для каждого числа ингредиентов - Bitmap рецептов с таким числом.
+    Фильтры по составу сводятся к пересечениям и разностям Bitmap
+    вместо самосоединений RecipeIngredient и HAVING COUNT в БД.
+    Изменённые рецепты берутся из журнала RECIPE_INGREDIENTS_VERSION
+    и перечитываются из БД; индекс строится заново при смене версии
+    данных, справочника ингредиентов или если журнал неполон.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._change = 0
+        self._ingredients = {}
+        self._data = RecipeIndexData(Bitmap(), {}, {})
+
+    def _read(self, recipe_ids=None):
+        """Множества id ингредиентов рецептов из БД."""
+        queryset = RecipeIngredient.objects.all()
+        if recipe_ids is not None:
+            queryset = queryset.filter(recipe__in=recipe_ids)
+        ingredients = defaultdict(set)
+        for recipe_id, ingredient_id in queryset.values_list(
+                'recipe_id', 'ingredient_id').iterator(chunk_size=10000):
+            ingredients[recipe_id].add(ingredient_id)
+        return ingredients
+
+    def _build(self):
+        self._ingredients = self._read()
+        postings = defaultdict(list)
+        sizes = defaultdict(list)
+        for recipe_id, ingredient_ids in self._ingredients.items():
+            sizes[len(ingredient_ids)].append(recipe_id)
+            for ingredient_id in ingredient_ids:
+                postings[ingredient_id].append(recipe_id)
+        return RecipeIndexData(
+            Bitmap.from_ids(self._ingredients),
+            {key: Bitmap.from_ids(ids) for key, ids in postings.items()},
+            {key: Bitmap.from_ids(ids) for key, ids in sizes.items()},
+        )
+
+    def _apply(self, recipe_ids):
+        """Новые данные индекса с перечитанными рецептами recipe_ids."""
+        current = self._read(recipe_ids)
+        added, removed = defaultdict(list), defaultdict(list)
+        for recipe_id in recipe_ids:
+            old = self._ingredients.pop(recipe_id, set())
+            new = current.get(recipe_id, set())
+            if new:
+                self._ingredients[recipe_id] = new
+            if old == new:
+                continue
+            for ingredient_id in old - new:
+                removed['ingredient', ingredient_id].append(recipe_id)
+            for ingredient_id in new - old:
+                added['ingredient', ingredient_id].append(recipe_id)
+            if old:
+                removed['size', len(old)].append(recipe_id)
+            if new:
+                added['size', len(new)].append(recipe_id)
+        recipes, postings, sizes = self._data
+        recipes = recipes.changed(
+            [pk for pk in recipe_ids if pk in current],
+            [pk for pk in recipe_ids if pk not in current]
+        )
+        postings, sizes = dict(postings), dict(sizes)
+        for kind, key in added.keys() | removed.keys():
+            bitmaps = postings if kind == 'ingredient' else sizes
+            bitmaps[key] = bitmaps.get(key, Bitmap()).changed(
+                added[kind, key], removed[kind, key])
+        return RecipeIndexData(recipes, postings, sizes)
+
+    def load(self):
+        """Данные индекса с учётом последних изменений рецептов."""
+        version = get_versions(
+            INGREDIENTS_VERSION, RECIPE_INGREDIENTS_VERSION,
+            journals=[RECIPE_INGREDIENTS_VERSION]
+        )
+        since = self._change
+        # С новой версией индекс всё равно перестраивается целиком.
+        last, changed = None, None
+        if version == self._version:
+            last, changed = get_changes(RECIPE_INGREDIENTS_VERSION, since)
+        if version != self._version or changed is None or changed:
+            with self._lock:
+                if version == self._version and self._change != since:
+                    # Пока ждали блокировку, индекс обновил другой поток.
+                    last, changed = get_changes(
+                        RECIPE_INGREDIENTS_VERSION, self._change)
+                if version != self._version or changed is None:
+                    # Журнал читается до индекса: изменения, записанные
+                    # во время сборки, применятся при следующем запросе.
+                    last = get_last_change(RECIPE_INGREDIENTS_VERSION)
+                    self._data = self._build()
+                    self._version = version
+                elif changed:
+                    self._data = self._apply(changed)
+                self._change = last
+        return self._data
+
+    def containing(self, ingredient_ids):
+        """Рецепты, в которых есть все ингредиенты ingredient_ids."""
+        recipes, postings, _ = self.load()
+        result = recipes
+        for pk in sorted(
+                ingredient_ids, key=lambda pk: len(postings.get(pk, ()))):
+            result &= postings.get(pk, Bitmap())
+            if not result:
+                break
+        return result
+
+    def containing_any(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ingredient_ids."""
+        _, postings, _ = self.load()
+        return Bitmap.union(
+            postings[pk] for pk in ingredient_ids if pk in postings)
+
+    def cookable(self, ingredient_ids, max_missing=0):
+        """
+        Рецепты, для которых из ингредиентов ingredient_ids не хватает
+        не больше max_missing.
+        Число имеющихся ингредиентов каждого рецепта считается сразу
+        для всех рецептов поразрядным сложением Bitmap ингредиентов:
+        counter[i] - рецепты, у которых i-й бит этого числа равен 1.
+        """
+        _, postings, sizes = self.load()
+        counter = []
+        for pk in set(ingredient_ids):
+            carry = postings.get(pk)
+            for position, digit in enumerate(counter):
+                if not carry:
+                    break
+                counter[position], carry = digit ^ carry, digit & carry
+            if carry:
+                counter.append(carry)
+        result = Bitmap()
+        for size, recipes in sizes.items():
+            need = size - max_missing
+            if need > 0:
+                recipes = self._at_least(counter, need, recipes)
+            result |= recipes
+        return result
+
+    def _at_least(self, counter, number, recipes):
+        """Рецепты из recipes, у которых число в counter не меньше number."""
+        greater, equal = Bitmap(), recipes
+        for position in reversed(
+                range(max(len(counter), number.bit_length()))):
+            digit = counter[position] if position < len(counter) else Bitmap()
+            if number >> position & 1:
+                equal &= digit
+            else:
+                greater |= equal & digit
+                equal -= digit
+            if not equal:
+                break
+        return greater | equal
+
+
+class TagIndex:
+    """
+    Слаги тегов -> id в памяти процесса, для фильтра по
+    Recipe.tags_mask без запроса к тегам. Перечитывается, когда
+    меняется версия данных TAGS_VERSION.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._ids = {}
+
+    def load(self, force=False):
+        version = get_version(TAGS_VERSION)
+        if force or version != self._version:
+            with self._lock:
+                if force or version != self._version:
+                    self._ids = dict(Tag.objects.values_list('slug', 'id'))
+                    self._version = version
+        return self._ids
+
+    def get_ids(self, slugs):
+        """
+        Слаги -> id для найденных тегов. Если слага нет в индексе,
+        индекс перечитывается из БД: новый тег мог быть создан без
+        смены версии, например при потере кэша.
+        """
+        ids = self.load()
+        if not ids.keys() >= set(slugs):
+            ids = self.load(force=True)
+        return {slug: ids[slug] for slug in slugs if slug in ids}
+
+    def choices(self):
+        return [(slug, slug) for slug in self.load()]
+
+    def has_exact_masks(self):
+        """Все теги имеют бит, то есть tags_mask задаёт теги точно."""
+        return all(map(get_tag_bit, self.load().values()))
+
+
+ingredient_index = IngredientIndex()
+recipe_ingredient_index = RecipeIngredientIndex()
+tag_index = TagIndex()
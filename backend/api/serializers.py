@@ -1,8 +1,13 @@
+from functools import partial
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import F
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
 from recipes.models import (
     Ingredient,
@@ -10,27 +15,98 @@ from recipes.models import (
     RecipeIngredient,
     Tag,
     Favourite,
-    ShoppingCart
+    ShoppingCart,
+    ShoppingListItem,
+    get_tags_mask
+)
+from recipes.renditions import get_rendition_name, renditions_ready
+from recipes.tasks import fan_out_recipes, update_similar_recipes
+from recipes.versions import (
+    RECIPE_INGREDIENTS_VERSION, bump_shopping_cart_versions, log_changes
 )
 
+from .search import tag_index
+
 User = get_user_model()
 
+FOLLOWED_IDS_ATTR = '_followed_author_ids'
+
+
+def get_followed_ids(request):
+    """
+    Id авторов, на которых подписан пользователь запроса.
+    Загружаются одним запросом и кэшируются на объекте запроса,
+    общем для всех сериализаторов с этим контекстом.
+    """
+    if not request.user.is_authenticated:
+        return frozenset()
+    if FOLLOWED_IDS_ATTR not in request.__dict__:
+        request.__dict__[FOLLOWED_IDS_ATTR] = set(
+            request.user.follower.values_list('follow_id', flat=True))
+    return request.__dict__[FOLLOWED_IDS_ATTR]
+
+
+def reset_followed_ids(request):
+    """Сбрасывает кэш подписок после их изменения в этом же запросе."""
+    request.__dict__.pop(FOLLOWED_IDS_ATTR, None)
+
+
+def get_recipes_limit(request):
+    """Значение recipes_limit из запроса или None."""
+    try:
+        return int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return None
+
+
+def group_recipes_by_author(authors, limit=None):
+    """Последние рецепты авторов одним запросом, сгруппированные по id."""
+    author_recipes = {}
+    for recipe in Recipe.objects.latest_by_author(authors, limit):
+        author_recipes.setdefault(recipe.author_id, []).append(recipe)
+    return author_recipes
+
+
+class RenditionField(serializers.ReadOnlyField):
+    """
+    Абсолютная ссылка на WebP-вариант kind изображения из source.
+    Варианты создаёт фоновая задача; пока она не отметила их в
+    модели (renditions_ready), отдаётся ссылка на оригинал.
+    """
+
+    def __init__(self, kind, **kwargs):
+        self.kind = kind
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        name = value.name
+        if renditions_ready(value):
+            name = get_rendition_name(name, self.kind)
+        url = value.storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
 
 class UserSerializer(UserSerializer):
     avatar = Base64ImageField(required=False, allow_null=True)
+    avatar_thumbnail = RenditionField(source='avatar', kind='thumbnail')
+    avatar_webp = RenditionField(source='avatar', kind='full')
     is_subscribed = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and request.user.follower.filter(follow=obj).exists())
+        return bool(request and obj.pk in get_followed_ids(request))
 
     class Meta:
         model = User
         fields = [
             'id', 'username', 'first_name', 'last_name',
-            'email', 'avatar', 'is_subscribed'
+            'email', 'avatar', 'avatar_thumbnail', 'avatar_webp',
+            'is_subscribed', 'recipes_count', 'followers_count'
         ]
+        read_only_fields = ['recipes_count', 'followers_count']
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -53,9 +129,75 @@ class AvatarSerializer(serializers.ModelSerializer):
         fields = ('avatar',)
 
 
+def get_objects_by_ids(queryset, ids, message):
+    """
+    Объекты queryset по списку id одним запросом, в порядке ids.
+    Если каких-то id нет, все они перечисляются в одной ошибке.
+    """
+    objects = queryset.in_bulk(set(ids))
+    missing = sorted(set(ids) - objects.keys())
+    if missing:
+        raise serializers.ValidationError(
+            message.format(', '.join(map(str, missing))))
+    return [objects[pk] for pk in ids]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Список первичных ключей, загружаемый одним запросом IN."""
+
+    def to_internal_value(self, data):
+        return get_objects_by_ids(
+            self.child_relation.get_queryset(),
+            super().to_internal_value(data),
+            self.child_relation.missing_message
+        )
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Первичный ключ, который при записи проверяется только на тип.
+    Объекты подставляет список (BulkManyRelatedField или
+    list_serializer_class сериализатора) одним запросом на все id.
+    """
+
+    def __init__(self, missing_message='Не найдены id: {}', **kwargs):
+        self.missing_message = missing_message
+        super().__init__(**kwargs)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class RecipeIngredientListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = get_objects_by_ids(
+            Ingredient.objects.all(),
+            [item['ingredient'] for item in items],
+            self.child.fields['id'].missing_message
+        )
+        for item, ingredient in zip(items, ingredients):
+            item['ingredient'] = ingredient
+        return items
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        source='ingredient', queryset=Ingredient.objects.all())
+    id = BulkPrimaryKeyRelatedField(
+        source='ingredient', queryset=Ingredient.objects.all(),
+        missing_message='Не найдены ингредиенты с id: {}')
     name = serializers.ReadOnlyField(source='ingredient.name')
     measurement_unit = serializers.ReadOnlyField(
         source='ingredient.measurement_unit')
@@ -63,43 +205,51 @@ class RecipeIngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = RecipeIngredient
         fields = ('id', 'name', 'measurement_unit', 'amount')
+        list_serializer_class = RecipeIngredientListSerializer
 
 
 class RecipeReadSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
+    image_thumbnail = RenditionField(source='image', kind='thumbnail')
+    image_webp = RenditionField(source='image', kind='full')
     tags = TagSerializer(many=True)
     ingredients = RecipeIngredientSerializer(many=True)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
-    def get_is_favorited(self, obj):
+    def _get_user_flag(self, obj, name, model_class, lookup):
+        """Флаг из аннотации queryset, либо отдельный запрос."""
+        if hasattr(obj, name):
+            return getattr(obj, name)
         request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and Favourite.objects.filter(
-                    user=request.user,
-                    recipe=obj).exists())
+        return bool(request and request.user.is_authenticated
+                    and model_class.objects.filter(
+                        user=request.user,
+                        **{lookup: obj}).exists())
+
+    def get_is_favorited(self, obj):
+        return self._get_user_flag(obj, 'is_favorited', Favourite, 'recipe')
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        return (request and request.user.is_authenticated
-                and ShoppingCart.objects.filter(
-                    user=request.user,
-                    recipes=obj).exists())
+        return self._get_user_flag(
+            obj, 'is_in_shopping_cart', ShoppingCart, 'recipes')
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'name',
-            'image', 'text', 'cooking_time', 'is_favorited',
-            'is_in_shopping_cart'
+            'image', 'image_thumbnail', 'image_webp', 'text',
+            'cooking_time', 'is_favorited',
+            'is_in_shopping_cart', 'favorites_count', 'in_carts_count'
         )
 
 
 class RecipeCreateSerializer(serializers.ModelSerializer):
     image = Base64ImageField(required=True, allow_null=False)
     ingredients = RecipeIngredientSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True)
+    tags = BulkPrimaryKeyRelatedField(
+        queryset=Tag.objects.all(), many=True,
+        missing_message='Не найдены теги с id: {}')
 
     class Meta:
         model = Recipe
@@ -154,70 +304,158 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
+        author = self.context['request'].user
         recipe = Recipe.objects.create(
-            author=self.context['request'].user,
+            author=author,
+            tags_mask=get_tags_mask(tag.id for tag in tags),
             **validated_data
         )
+        User.objects.filter(pk=author.pk).update(
+            recipes_count=F('recipes_count') + 1)
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients)
+        fan_out_recipes.delay(recipe.pk)
+        update_similar_recipes.delay(recipe.pk)
+        transaction.on_commit(
+            partial(log_changes, RECIPE_INGREDIENTS_VERSION, [recipe.pk]))
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """
+        Приводит ингредиенты рецепта к ingredients, меняя только
+        отличающиеся строки. Возвращает id затронутых ингредиентов.
+        """
+        current = {
+            item.ingredient_id: item
+            for item in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        amounts = {
+            ingredient['ingredient'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        removed = current.keys() - amounts.keys()
+        added = amounts.keys() - current.keys()
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id, item.amount)
+            if item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if removed:
+            RecipeIngredient.objects.filter(
+                pk__in=[current[ingredient_id].pk for ingredient_id in removed]
+            ).delete()
+        if added:
+            RecipeIngredient.objects.bulk_create([
+                RecipeIngredient(
+                    recipe=recipe,
+                    ingredient_id=ingredient_id,
+                    amount=amounts[ingredient_id]
+                ) for ingredient_id in added
+            ])
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        return removed | added | {item.ingredient_id for item in changed}
+
     @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
-        RecipeIngredient.objects.filter(recipe=instance).delete()
+        tag_ids = {tag.id for tag in tags}
+        tags_mask = get_tags_mask(tag_ids)
+        tags_changed = instance.tags_mask != tags_mask or (
+            not tag_index.has_exact_masks()
+            and set(instance.tags.values_list('id', flat=True)) != tag_ids
+        )
+        instance.tags_mask = tags_mask
         instance = super().update(instance, validated_data)
-        instance.tags.set(tags)
-        self.create_ingredients(instance, ingredients)
+        if tags_changed:
+            instance.tags.set(tags)
+        ingredient_ids = self.update_ingredients(instance, ingredients)
+        if ingredient_ids:
+            update_similar_recipes.delay(instance.pk)
+            transaction.on_commit(partial(
+                log_changes, RECIPE_INGREDIENTS_VERSION, [instance.pk]))
+            user_ids = list(
+                instance.shopping_carts.values_list('user_id', flat=True))
+            if user_ids:
+                ShoppingListItem.objects.refresh(user_ids, ingredient_ids)
+                transaction.on_commit(
+                    partial(bump_shopping_cart_versions, user_ids))
         return instance
 
     def to_representation(self, instance):
+        instance = Recipe.objects.with_related().with_user_flags(
+            self.context['request'].user
+        ).get(pk=instance.pk)
         return RecipeReadSerializer(instance, context=self.context).data
 
 
 class AuthorRecipeSerializer(serializers.ModelSerializer):
+    image_thumbnail = RenditionField(source='image', kind='thumbnail')
+    image_webp = RenditionField(source='image', kind='full')
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'image_thumbnail',
+            'image_webp',
             'cooking_time'
         )
 
 
 class SubscriptionSerializer(UserSerializer):
+    """
+    Автор с его рецептами.
+    Рецепты берутся из context['author_recipes'] (автор -> список),
+    который вьюсет собирает одним запросом для всей страницы.
+    """
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
-
-    def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
 
     def get_recipes(self, obj):
         request = self.context.get('request')
         if not request:
             return []
-
-        recipes = Recipe.objects.filter(author=obj).order_by('-created_at')
-        recipes_limit = request.query_params.get('recipes_limit')
-
-        if recipes_limit is not None:
-            try:
-                recipes_limit = int(recipes_limit)
-                recipes = recipes[:recipes_limit]
-            except ValueError:
-                pass
-
+        author_recipes = self.context.get('author_recipes')
+        if author_recipes is None:
+            author_recipes = group_recipes_by_author(
+                [obj], get_recipes_limit(request))
         return AuthorRecipeSerializer(
-            recipes, many=True, context={'request': request}
+            author_recipes.get(obj.pk, []),
+            many=True,
+            context={'request': request}
         ).data
 
     class Meta(UserSerializer.Meta):
-        fields = UserSerializer.Meta.fields + ['recipes', 'recipes_count']
+        fields = UserSerializer.Meta.fields + ['recipes']
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
+    image_thumbnail = RenditionField(source='image', kind='thumbnail')
+    image_webp = RenditionField(source='image', kind='full')
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = (
+            'id', 'name', 'image', 'image_thumbnail', 'image_webp',
+            'cooking_time'
+        )
+
+
+class SimilarRecipeSerializer(RecipeShortSerializer):
+    similarity = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeShortSerializer.Meta):
+        fields = RecipeShortSerializer.Meta.fields + ('similarity',)
+
+
+class BatchIdsSerializer(serializers.Serializer):
+    """Список id для массовых действий."""
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_IDS,
+    )
@@ -0,0 +1,903 @@
+import json
+import tempfile
+from bisect import bisect_left
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.metrics import render
+from jobs.models import Job
+from jobs.queue import claim, enqueue, run, task
+from recipes import similarity
+from recipes.models import (
+    Favourite, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    ShoppingListItem, Tag
+)
+from recipes.renditions import mark_renditions_ready
+from recipes.versions import (
+    CHANGE_KEY, INGREDIENTS_VERSION, RECIPE_INGREDIENTS_VERSION,
+    TAGS_VERSION, VERSION_KEY, bump_version, get_last_change, get_version,
+    log_changes
+)
+from users.models import Follower
+
+User = get_user_model()
+
+RECIPES_COUNT = 12
+
+
+@task
+def take_over(job_id):
+    """Имитирует другой обработчик, перехвативший задачу."""
+    Job.objects.filter(pk=job_id).update(attempts=F('attempts') + 1)
+
+
+class CatalogImportTest(TestCase):
+    """Загрузка справочников: upsert по ключу и --dry-run."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def run_import(self, command, name, content, *args):
+        path = self.directory / name
+        path.write_text(content, encoding='utf-8')
+        out = StringIO()
+        call_command(command, '--path', str(path), *args, stdout=out)
+        return out.getvalue()
+
+    def test_tags(self):
+        Tag.objects.create(name='Обед', slug='lunch')
+        Tag.objects.create(name='Ужин', slug='dinner')
+        content = (
+            'name,slug\nЗавтрак,breakfast\nОбед днём,lunch\nУжин,dinner\n')
+        self.assertIn(
+            'Будет добавлено: 1, обновлено: 1, без изменений: 1',
+            self.run_import('import_tags', 'tags.csv', content, '--dry-run'))
+        self.assertEqual(Tag.objects.count(), 2)
+        self.assertIn(
+            'Добавлено: 1, обновлено: 1, без изменений: 1',
+            self.run_import('import_tags', 'tags.csv', content))
+        self.assertEqual(
+            dict(Tag.objects.values_list('slug', 'name')),
+            {'breakfast': 'Завтрак', 'lunch': 'Обед днём', 'dinner': 'Ужин'})
+        self.assertIn(
+            'Добавлено: 0, обновлено: 0, без изменений: 3',
+            self.run_import('import_tags', 'tags.csv', content))
+
+    def test_ingredients(self):
+        Ingredient.objects.create(name='мука', measurement_unit='г')
+        content = json.dumps([
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'мука', 'measurement_unit': 'г'},
+            {'name': 'вода'},
+        ], ensure_ascii=False)
+        self.assertIn(
+            'Добавлено: 1, обновлено: 0, без изменений: 1, ошибок: 1',
+            self.run_import('import_ingredients', 'ingredients.json', content))
+        self.assertIn(
+            'Добавлено: 0, обновлено: 0, без изменений: 2, ошибок: 1',
+            self.run_import('import_ingredients', 'ingredients.json', content))
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+
+class RecipeQueryCountTest(TestCase):
+    """
+    Число запросов к БД при чтении рецептов не зависит от размера
+    страницы: рост с размером страницы означает N+1.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='-')
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'Тег {number}', slug=f'tag{number}')
+            for number in range(3)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(5)
+        )
+        for number in range(RECIPES_COUNT):
+            author = User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com', password='-')
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='-',
+                cooking_time=10, image='recipes/images/test.png')
+            recipe.tags.set(tags[:number % 3 + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredient, amount=1)
+                for ingredient in ingredients[:number % 5 + 1]
+            )
+            if number % 2:
+                Favourite.objects.create(user=cls.user, recipe=recipe)
+                ShoppingCart.objects.create(user=cls.user, recipes=recipe)
+        cls.recipe = recipe
+
+    def setUp(self):
+        self.anonymous = APIClient()
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}')
+
+    def assert_list_queries(self, client, count):
+        for limit in (2, 10):
+            with self.subTest(limit=limit), self.assertNumQueries(count):
+                response = client.get(f'/api/recipes/?limit={limit}')
+            self.assertEqual(len(response.json()['results']), limit)
+
+    def test_list_anonymous(self):
+        self.assert_list_queries(self.anonymous, 4)
+
+    def test_list_authenticated(self):
+        self.assert_list_queries(self.client, 6)
+
+    def test_list_filtered(self):
+        ingredient = RecipeIngredient.objects.first().ingredient_id
+        url = f'/api/recipes/?ingredients={ingredient}&limit=10'
+        self.client.get(url)
+        # Индекс фильтра уже в памяти, запросы те же, что без фильтра.
+        with self.assertNumQueries(6):
+            self.client.get(url)
+
+    def test_list_cursor(self):
+        for limit in (2, 10):
+            with self.subTest(limit=limit), self.assertNumQueries(5):
+                response = self.client.get(
+                    f'/api/recipes/?cursor=&limit={limit}')
+            self.assertEqual(len(response.json()['results']), limit)
+
+    def test_retrieve(self):
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/recipes/{self.recipe.pk}/')
+        self.assertEqual(response.json()['id'], self.recipe.pk)
+
+
+class FeedTest(TestCase):
+    """Лента подписок: порядок рецептов и число запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='-')
+        authors = [
+            User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com', password='-')
+            for number in range(3)
+        ]
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=authors[number % 3], name=f'Рецепт {number}',
+                text='-', cooking_time=10, image='recipes/images/test.png')
+            for number in range(9)
+        )
+        start = timezone.now()
+        for number, recipe in enumerate(recipes):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                created_at=start - timedelta(hours=number))
+        client = APIClient()
+        client.force_authenticate(cls.reader)
+        for author in authors[:2]:
+            client.post(f'/api/users/{author.pk}/subscribe/')
+        cls.expected = [
+            recipe.name for number, recipe in enumerate(recipes)
+            if number % 3 != 2
+        ]
+
+    def setUp(self):
+        caches['local'].clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=(
+            f'Token {Token.objects.create(user=self.reader)}'))
+
+    def test_order(self):
+        names, url = [], '/api/recipes/feed/?limit=4'
+        while url:
+            data = self.client.get(url).json()
+            names += [recipe['name'] for recipe in data['results']]
+            url = data['next']
+        self.assertEqual(names, self.expected)
+
+    def test_queries(self):
+        # Токен, подтягивание рецептов популярных авторов, лента,
+        # рецепты, теги, ингредиенты, подписки читателя.
+        with self.assertNumQueries(7):
+            self.client.get('/api/recipes/feed/')
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/recipes/feed/')
+        self.assertEqual(
+            [recipe['name'] for recipe in response.json()['results']],
+            self.expected[:settings.DEFAULT_PAGE_SIZE])
+
+
+class SubscriptionTest(TestCase):
+    """Подписки: последние рецепты каждого автора одним запросом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='-')
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com', password='-')
+            for number in range(3)
+        ]
+        start = timezone.now()
+        cls.recipes = {}
+        for author, count in zip(cls.authors, (0, 2, 5)):
+            cls.recipes[author.pk] = []
+            for number in range(count):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'{author.username} {number}',
+                    text='-', cooking_time=10,
+                    image='recipes/images/test.png')
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    created_at=start - timedelta(hours=number))
+                cls.recipes[author.pk].append(recipe.name)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def subscribe_all(self):
+        for author in self.authors:
+            Follower.objects.create(user=self.reader, follow=author)
+
+    def get_recipes(self, url):
+        return {
+            author['id']: [recipe['name'] for recipe in author['recipes']]
+            for author in self.client.get(url).json()['results']
+        }
+
+    def test_recipes_limit(self):
+        self.subscribe_all()
+        self.assertEqual(
+            self.get_recipes('/api/users/subscriptions/?recipes_limit=3'),
+            {pk: names[:3] for pk, names in self.recipes.items()})
+        self.assertEqual(
+            self.get_recipes('/api/users/subscriptions/'), self.recipes)
+
+    def test_queries_per_page(self):
+        self.subscribe_all()
+        counts = []
+        for limit in (1, 3):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(
+                    f'/api/users/subscriptions/?limit={limit}'
+                    '&recipes_limit=2')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_is_subscribed(self):
+        author = self.authors[1]
+        url = f'/api/users/{author.pk}/'
+        self.assertFalse(self.client.get(url).json()['is_subscribed'])
+        response = self.client.post(f'{url}subscribe/')
+        self.assertTrue(response.json()['is_subscribed'])
+        self.assertTrue(self.client.get(url).json()['is_subscribed'])
+        self.client.delete(f'{url}subscribe/')
+        self.assertFalse(self.client.get(url).json()['is_subscribed'])
+
+
+class RecipeTagFilterTest(TestCase):
+    """Фильтр по тегам не зависит от того, какие теги знает процесс."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='-')
+        cls.breakfast = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Каша', text='-', cooking_time=10,
+            image='recipes/images/test.png')
+        cls.recipe.tags.set([cls.breakfast])
+
+    def get_ids(self, query):
+        response = self.client.get(f'/api/recipes/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def create_tag_unversioned(self, slug):
+        """Тег, о котором индекс процесса не узнал по версии."""
+        version = get_version(TAGS_VERSION)
+        tag = Tag.objects.create(name=slug, slug=slug)
+        cache.set(VERSION_KEY.format(TAGS_VERSION), version, timeout=None)
+        return tag
+
+    def test_recipe_with_unknown_tag(self):
+        self.get_ids('tags=breakfast')
+        self.recipe.tags.add(self.create_tag_unversioned('dessert'))
+        self.assertEqual(self.get_ids('tags=breakfast'), [self.recipe.pk])
+
+    def test_unknown_slug(self):
+        self.get_ids('tags=breakfast')
+        self.create_tag_unversioned('dinner')
+        self.assertEqual(self.get_ids('tags=dinner'), [])
+        self.assertEqual(
+            self.client.get('/api/recipes/?tags=missing').status_code, 400)
+
+
+class RecipeSearchPaginationTest(TestCase):
+    """Поиск с курсором сохраняет порядок по релевантности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='-')
+        cls.best = Recipe.objects.create(
+            author=author, name='Борщ', text='-', cooking_time=10,
+            image='recipes/images/test.png')
+        cls.worst = Recipe.objects.create(
+            author=author, name='Салат', text='подавать к борщу',
+            cooking_time=10, image='recipes/images/test.png')
+
+    def test_search_with_cursor(self):
+        for query in ('search=борщ', 'search=борщ&cursor='):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/recipes/?{query}')
+                self.assertEqual(
+                    [recipe['id'] for recipe in response.json()['results']],
+                    [self.best.pk, self.worst.pk]
+                )
+
+
+class RecipeUpdateTest(TestCase):
+    """Изменение рецепта меняет только отличающиеся строки состава."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='-')
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(3)
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Борщ', text='-', cooking_time=10,
+            image='recipes/images/test.png')
+        cls.recipe.tags.set([cls.tag])
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(
+                recipe=cls.recipe, ingredient=ingredient, amount=10)
+            for ingredient in cls.ingredients
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def patch(self, ingredients, tags=None, **data):
+        return self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/',
+            {
+                'ingredients': [
+                    {'id': pk, 'amount': amount}
+                    for pk, amount in ingredients
+                ],
+                'tags': [self.tag.pk] if tags is None else tags,
+                **data,
+            },
+            format='json'
+        )
+
+    def get_link_writes(self, queries):
+        return [
+            query['sql'].split()[0] for query in queries.captured_queries
+            if 'recipes_recipeingredient' in query['sql']
+            and not query['sql'].startswith('SELECT')
+        ]
+
+    def test_unchanged_ingredients(self):
+        ingredients = [
+            (ingredient.pk, 10) for ingredient in reversed(self.ingredients)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(ingredients, name='Щи')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'Щи')
+        self.assertEqual(self.get_link_writes(queries), [])
+
+    def test_changed_amount(self):
+        ingredients = [(ingredient.pk, 10) for ingredient in self.ingredients]
+        ingredients[0] = (self.ingredients[0].pk, 20)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(ingredients)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_link_writes(queries), ['UPDATE'])
+        self.assertEqual(
+            RecipeIngredient.objects.get(
+                recipe=self.recipe, ingredient=self.ingredients[0]).amount,
+            20)
+
+    def test_missing_ids(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch(
+                [(self.ingredients[0].pk, 10), (998, 10), (997, 10)],
+                tags=[self.tag.pk, 999]
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            'ingredients': ['Не найдены ингредиенты с id: 997, 998'],
+            'tags': ['Не найдены теги с id: 999'],
+        })
+        self.assertEqual(len([
+            query for query in queries.captured_queries
+            if 'FROM "recipes_ingredient"' in query['sql']
+        ]), 1)
+
+
+class SimilarRecipesTest(TestCase):
+    """Похожие рецепты по коэффициенту Жаккара состава."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='-')
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(7)
+        )
+        cls.recipes = {}
+        for name, numbers in (
+                ('Борщ', (0, 1, 2, 3)), ('Щи', (0, 1, 2, 3)),
+                ('Рассольник', (0, 1, 2)), ('Солянка', (0, 4, 5, 6)),
+                ('Компот', (4, 5))):
+            recipe = Recipe.objects.create(
+                author=author, name=name, text='-', cooking_time=10,
+                image='recipes/images/test.png')
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe, ingredient=ingredients[number], amount=1)
+                for number in numbers
+            )
+            cls.recipes[name] = recipe
+
+    def get_similar(self, name):
+        response = self.client.get(
+            f'/api/recipes/{self.recipes[name].pk}/similar/')
+        return [
+            (recipe['name'], recipe['similarity'])
+            for recipe in response.json()
+        ]
+
+    def test_build(self):
+        call_command('build_similar_recipes', stdout=StringIO())
+        self.assertEqual(
+            self.get_similar('Борщ'), [('Щи', 1.0), ('Рассольник', 0.75)])
+
+    def test_update(self):
+        similarity.update(self.recipes['Рассольник'].pk)
+        self.assertEqual(self.get_similar('Борщ'), [('Рассольник', 0.75)])
+        self.assertEqual(
+            self.get_similar('Рассольник'),
+            [('Щи', 0.75), ('Борщ', 0.75)])
+
+
+class RenditionFieldTest(TestCase):
+    """Ссылки на варианты изображения появляются после отметки задачи."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='-')
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Борщ', text='-', cooking_time=10,
+            image='recipes/images/test.png')
+
+    def get_recipe(self):
+        return self.client.get(f'/api/recipes/{self.recipe.pk}/').json()
+
+    def test_original_until_renditions_ready(self):
+        data = self.get_recipe()
+        self.assertEqual(data['image_webp'], data['image'])
+        mark_renditions_ready(self.recipe, 'image')
+        data = self.get_recipe()
+        self.assertTrue(data['image_webp'].endswith('/test.full.webp'))
+        self.assertTrue(
+            data['image_thumbnail'].endswith('/test.thumbnail.webp'))
+
+    def test_replaced_image(self):
+        mark_renditions_ready(self.recipe, 'image')
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            image='recipes/images/new.png')
+        data = self.get_recipe()
+        self.assertEqual(data['image_webp'], data['image'])
+
+
+class JobRunTest(TestCase):
+    """Обработчик не трогает задачу, которую перехватил другой."""
+
+    def test_taken_over_job_kept(self):
+        job = enqueue(f'{__name__}.take_over', None)
+        Job.objects.filter(pk=job.pk).update(args=[job.pk])
+        job = claim()
+        self.assertTrue(run(job))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.Status.RUNNING)
+        self.assertEqual(job.attempts, 2)
+
+
+class CounterTest(TestCase):
+    """Счётчики меняются только при настоящем добавлении и удалении."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='-')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='-')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Борщ', text='-', cooking_time=10,
+            image='recipes/images/test.png')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_counter(self, url, instance, counter):
+        for method, status_code, count in (
+                ('post', 201, 1), ('post', 400, 1),
+                ('delete', 204, 0), ('delete', 400, 0)):
+            with self.subTest(method=method, status_code=status_code):
+                response = getattr(self.client, method)(url)
+                self.assertEqual(response.status_code, status_code)
+                instance.refresh_from_db()
+                self.assertEqual(getattr(instance, counter), count)
+
+    def test_favorite(self):
+        self.assert_counter(
+            f'/api/recipes/{self.recipe.pk}/favorite/',
+            self.recipe, 'favorites_count')
+
+    def test_shopping_cart(self):
+        self.assert_counter(
+            f'/api/recipes/{self.recipe.pk}/shopping_cart/',
+            self.recipe, 'in_carts_count')
+
+    def test_subscribe(self):
+        self.assert_counter(
+            f'/api/users/{self.author.pk}/subscribe/',
+            self.author, 'followers_count')
+
+
+class BatchCounterTest(TestCase):
+    """Пакетные действия меняют счётчики на число изменённых связей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='-')
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Борщ', text='-', cooking_time=10,
+            image='recipes/images/test.png')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def favorite_batch(self, method):
+        return getattr(self.client, method)(
+            '/api/recipes/favorite/batch/', {'ids': [self.recipe.pk, 999]},
+            format='json'
+        ).json()['results']
+
+    def get_count(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.favorites_count
+
+    def test_add_twice(self):
+        self.assertEqual(
+            [item['status'] for item in self.favorite_batch('post')],
+            ['created', 'not_found'])
+        self.assertEqual(
+            self.favorite_batch('post')[0]['status'], 'exists')
+        self.assertEqual(self.get_count(), 1)
+
+    def test_delete_duplicates(self):
+        Favourite.objects.bulk_create(
+            [Favourite(user=self.user, recipe=self.recipe)] * 2)
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_count=2)
+        self.assertEqual(
+            self.favorite_batch('delete')[0]['status'], 'deleted')
+        self.assertEqual(self.get_count(), 0)
+        self.assertEqual(
+            self.favorite_batch('delete')[0]['status'], 'missing')
+
+    def test_single_delete_statement(self):
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=self.user, name=f'Рецепт {number}', text='-',
+                cooking_time=10, image='recipes/images/test.png')
+            for number in range(5)
+        )
+        ids = [recipe.pk for recipe in recipes]
+        self.client.post(
+            '/api/recipes/favorite/batch/', {'ids': ids}, format='json')
+        with CaptureQueriesContext(connection) as queries:
+            results = self.client.delete(
+                '/api/recipes/favorite/batch/', {'ids': ids}, format='json'
+            ).json()['results']
+        self.assertEqual(
+            {item['status'] for item in results}, {'deleted'})
+        self.assertEqual(len([
+            query for query in queries.captured_queries
+            if query['sql'].startswith('DELETE')
+        ]), 1)
+        self.assertEqual(
+            set(Recipe.objects.filter(pk__in=ids).values_list(
+                'favorites_count', flat=True)), {0})
+
+
+class ShoppingListTest(TestCase):
+    """Сводный список покупок следует за корзиной и составом рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='-')
+        cls.buyer = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='-')
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='-')
+        cls.salt, cls.water = Ingredient.objects.bulk_create([
+            Ingredient(name='соль', measurement_unit='г'),
+            Ingredient(name='вода', measurement_unit='мл'),
+        ])
+        cls.soup, cls.tea = (
+            Recipe.objects.create(
+                author=author, name=name, text='-', cooking_time=10,
+                image='recipes/images/test.png')
+            for author, name in ((cls.author, 'Суп'), (cls.admin, 'Чай'))
+        )
+        cls.soup_salt, _, _ = RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(
+                recipe=cls.soup, ingredient=cls.salt, amount=10),
+            RecipeIngredient(
+                recipe=cls.soup, ingredient=cls.water, amount=500),
+            RecipeIngredient(
+                recipe=cls.tea, ingredient=cls.water, amount=200),
+        ])
+
+    def setUp(self):
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        for recipe in (self.soup, self.tea):
+            client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.client.force_login(self.admin)
+
+    def get_totals(self):
+        return dict(ShoppingListItem.objects.filter(
+            user=self.buyer
+        ).values_list('ingredient__name', 'total_amount'))
+
+    def test_cart(self):
+        self.assertEqual(self.get_totals(), {'соль': 10, 'вода': 700})
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        client.delete(f'/api/recipes/{self.soup.pk}/shopping_cart/')
+        self.assertEqual(self.get_totals(), {'вода': 200})
+
+    def test_author_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.delete()
+        self.assertEqual(self.get_totals(), {'вода': 200})
+
+    def test_admin_recipe_ingredient_change(self):
+        self.client.post(
+            f'/admin/recipes/recipeingredient/{self.soup_salt.pk}/change/',
+            {'recipe': self.soup.pk, 'ingredient': self.water.pk,
+             'amount': 5}
+        )
+        self.assertEqual(self.get_totals(), {'вода': 705})
+
+    def test_admin_cart_delete(self):
+        cart = ShoppingCart.objects.get(recipes=self.tea)
+        self.client.post(
+            f'/admin/recipes/shoppingcart/{cart.pk}/delete/', {'post': 'yes'})
+        self.assertEqual(self.get_totals(), {'соль': 10, 'вода': 500})
+
+    def download(self, export_format, **headers):
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        return client.get(
+            '/api/recipes/download_shopping_cart/',
+            {'format': export_format}, **headers)
+
+    def test_export_formats(self):
+        bodies = {
+            export_format: b''.join(
+                self.download(export_format).streaming_content).decode()
+            for export_format in ('txt', 'csv', 'json')
+        }
+        self.assertEqual(bodies['txt'], 'вода (мл) — 700\nсоль (г) — 10')
+        self.assertEqual(
+            bodies['csv'],
+            'name,measurement_unit,amount\r\nвода,мл,700\r\nсоль,г,10\r\n')
+        self.assertEqual(json.loads(bodies['json']), [
+            {'name': 'вода', 'measurement_unit': 'мл', 'amount': 700},
+            {'name': 'соль', 'measurement_unit': 'г', 'amount': 10},
+        ])
+
+    def test_export_not_modified(self):
+        etag = self.download('txt')['ETag']
+        response = self.download('txt', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertNotEqual(self.download('csv')['ETag'], etag)
+        client = APIClient()
+        client.force_authenticate(self.buyer)
+        client.delete(f'/api/recipes/{self.tea.pk}/shopping_cart/')
+        response = self.download('txt', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def rebuild(self, *args):
+        out = StringIO()
+        call_command('rebuild_shopping_lists', *args, stdout=out)
+        return out.getvalue()
+
+    def test_rebuild_check(self):
+        self.assertIn('Расхождений нет', self.rebuild('--check'))
+        ShoppingListItem.objects.filter(ingredient=self.water).update(
+            total_amount=1)
+        ShoppingListItem.objects.filter(ingredient=self.salt).delete()
+        self.assertIn(
+            'нет строк: 1, неверная сумма: 1', self.rebuild('--check'))
+        self.assertEqual(self.get_totals(), {'вода': 1})
+        self.assertIn('Расхождения исправлены', self.rebuild())
+        self.assertEqual(self.get_totals(), {'соль': 10, 'вода': 700})
+
+
+class RecipeIngredientFilterTest(TestCase):
+    """Индекс ингредиентов рецептов перестраивается при пропуске в журнале."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='-')
+        cls.ingredient = Ingredient.objects.create(
+            name='Свёкла', measurement_unit='г')
+        cls.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='-',
+                cooking_time=10, image='recipes/images/test.png')
+            for number in range(3)
+        ]
+        RecipeIngredient.objects.create(
+            recipe=cls.recipes[0], ingredient=cls.ingredient, amount=1)
+
+    def setUp(self):
+        bump_version(RECIPE_INGREDIENTS_VERSION)
+
+    def get_ids(self):
+        response = self.client.get(
+            f'/api/recipes/?ingredients={self.ingredient.pk}')
+        return sorted(recipe['id'] for recipe in response.json()['results'])
+
+    def test_journal_gap(self):
+        self.assertEqual(self.get_ids(), [self.recipes[0].pk])
+        first = get_last_change(RECIPE_INGREDIENTS_VERSION) + 1
+        for recipe in self.recipes[1:]:
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=self.ingredient, amount=1)
+            log_changes(RECIPE_INGREDIENTS_VERSION, [recipe.pk])
+        cache.delete(CHANGE_KEY.format(RECIPE_INGREDIENTS_VERSION, first))
+        self.assertEqual(
+            self.get_ids(), [recipe.pk for recipe in self.recipes])
+
+
+class IngredientSearchTest(TestCase):
+    """Поиск ингредиентов: начало названия, подстрока, опечатки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in (
+                'овсяная мука', 'муки', 'мука пшеничная', 'мак', 'мукка',
+                'ржаная мука', 'мука', 'соль'
+            )
+        )
+
+    def setUp(self):
+        bump_version(INGREDIENTS_VERSION)
+
+    def test_ranking(self):
+        response = self.client.get('/api/ingredients/?search=Мука')
+        self.assertEqual(
+            [item['name'] for item in response.json()],
+            ['мука', 'мука пшеничная', 'ржаная мука', 'овсяная мука',
+             'мукка', 'муки']
+        )
+
+
+class IngredientResponseCacheTest(TestCase):
+    """Ответы справочника: ETag по версии данных, без записей в БД."""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('молоко', 'мука', 'соль')
+        )
+
+    def setUp(self):
+        bump_version(INGREDIENTS_VERSION)
+
+    def test_filtered_request(self):
+        url = '/api/ingredients/?name=мо'
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(
+            [item['name'] for item in response.json()], ['молоко'])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_version(self):
+        etag = self.client.get('/api/ingredients/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='морковь', measurement_unit='г')
+        response = self.client.get(
+            '/api/ingredients/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 4)
+
+
+@override_settings(METRICS_DIR=None)
+class MetricsTest(TestCase):
+    """Метрики в текстовом формате Prometheus."""
+
+    def test_render(self):
+        buckets = settings.METRICS_QUERY_BUCKETS
+        values = [0] * (len(buckets) + 2)
+        for value in (3, 7):
+            values[bisect_left(buckets, value)] += 1
+            values[-1] += value
+        labels = ('Вьюсет."действие"', 'GET', '2xx')
+        lines = render({('http_db_queries', labels): values}).splitlines()
+        label_text = 'route="Вьюсет.\\"действие\\"",method="GET",status="2xx"'
+        self.assertEqual(lines[:2], [
+            '# HELP foodgram_http_db_queries Запросов к БД за запрос',
+            '# TYPE foodgram_http_db_queries histogram',
+        ])
+        self.assertEqual(lines[2:-2], [
+            f'foodgram_http_db_queries_bucket{{{label_text},le="{bound}"}} '
+            f'{0 if bound < 3 else 1 if bound < 8 else 2}'
+            for bound in buckets
+        ] + [f'foodgram_http_db_queries_bucket{{{label_text},le="+Inf"}} 2'])
+        self.assertEqual(lines[-2:], [
+            f'foodgram_http_db_queries_sum{{{label_text}}} 10',
+            f'foodgram_http_db_queries_count{{{label_text}}} 2',
+        ])
+
+    def test_endpoint(self):
+        self.client.get('/api/tags/')
+        response = self.client.get('/metrics')
+        self.assertEqual(
+            response['Content-Type'],
+            'text/plain; version=0.0.4; charset=utf-8')
+        self.assertRegex(
+            response.content.decode(),
+            r'foodgram_http_request_duration_seconds_count\{'
+            r'route="TagViewSet.list",method="GET",status="2xx"\} [1-9]'
+        )
@@ -1,8 +1,14 @@
+import hashlib
+from collections import defaultdict
+from functools import partial
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, F
 from django.shortcuts import get_object_or_404, redirect
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status
@@ -10,47 +16,145 @@ from rest_framework.decorators import action, api_view
 from rest_framework.permissions import (
     AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
 )
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet, ReadOnlyModelViewSet
 
 from api.filters import IngredientFilter, RecipeFilter
 from recipes.models import (
-    Favourite, Ingredient, Recipe, RecipeIngredient, ShoppingCart, Tag
+    Favourite, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    ShoppingListItem, Tag, TimelineEntry
+)
+from recipes.versions import (
+    INGREDIENTS_VERSION, SHOPPING_CART_VERSION, TAGS_VERSION,
+    bump_shopping_cart_versions, get_version
 )
 from users.models import Follower
-from .pagination import Pagination
+from .exports import (
+    EXPORT_FORMATS, encode_stream, get_shopping_list, get_shopping_list_state
+)
+from .mixins import (
+    CursorPaginationMixin, QueryBudgetMixin, VersionedCacheMixin
+)
+from .pagination import (
+    Pagination, RecipeCursorPagination, UserCursorPagination
+)
 from .permissions import IsAuthorOrReadOnly
+from .renderers import CSVRenderer, PlainTextRenderer
+from .search import ingredient_index
 from .serializers import (
-    AvatarSerializer, IngredientSerializer, RecipeShortSerializer,
-    RecipeCreateSerializer, RecipeReadSerializer, SubscriptionSerializer,
-    TagSerializer, UserSerializer
+    AvatarSerializer, BatchIdsSerializer, IngredientSerializer,
+    RecipeShortSerializer, RecipeCreateSerializer, RecipeReadSerializer,
+    SimilarRecipeSerializer, SubscriptionSerializer, TagSerializer,
+    UserSerializer, get_recipes_limit, group_recipes_by_author,
+    reset_followed_ids
 )
 
 User = get_user_model()
 
+FEED_PULL_KEY = 'feed_pull:{}'
+
+
+@transaction.atomic
+def apply_batch(request, model_class, field, targets, counter):
+    """
+    Массово добавляет (POST) или удаляет (DELETE) связи model_class
+    пользователя запроса с объектами targets через поле field.
+    Строки targets из запроса блокируются (SELECT ... FOR UPDATE) до
+    конца транзакции, поэтому пакеты с общими объектами выполняются
+    по очереди. Счётчик counter меняется на число действительно
+    вставленных связей (они пересчитываются после bulk_create) или
+    удалённых одним DELETE ... IN (посчитанных под блокировкой).
+    Возвращает id изменённых объектов и исход по каждому id:
+    created/exists или deleted/missing, а для несуществующих
+    (и недоступных) объектов - not_found.
+    """
+    serializer = BatchIdsSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = list(dict.fromkeys(serializer.validated_data['ids']))
+    found = set(targets.filter(pk__in=ids).select_for_update().order_by(
+        'pk').values_list('pk', flat=True))
+    links = model_class.objects.filter(user=request.user)
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+    def count_links(pks):
+        return dict(links.filter(**{f'{field}__in': pks}).values_list(
+            field).annotate(count=Count('pk')).order_by())
+
+    linked = count_links(found)
+    if request.method == 'POST':
+        model_class.objects.bulk_create([
+            model_class(user=request.user, **{f'{field}_id': pk})
+            for pk in ids if pk in found and pk not in linked
+        ], ignore_conflicts=True)
+        deltas = count_links(found - linked.keys())
+        done, skipped = 'created', 'exists'
+    else:
+        links.filter(**{f'{field}__in': list(linked)}).delete()
+        deltas = {pk: -count for pk, count in linked.items()}
+        done, skipped = 'deleted', 'missing'
+    by_delta = defaultdict(list)
+    for pk, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(pk)
+    for delta, pks in by_delta.items():
+        targets.model.objects.filter(pk__in=pks).update(
+            **{counter: F(counter) + delta})
+    changed = [pk for pk in ids if deltas.get(pk)]
+    return changed, [
+        {
+            'id': pk,
+            'status': (
+                done if deltas.get(pk)
+                else skipped if pk in found
+                else 'not_found'
+            ),
+        }
+        for pk in ids
+    ]
+
+
+class IngredientViewSet(VersionedCacheMixin, ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
-    search_fields = ['name']
+    data_version = INGREDIENTS_VERSION
     http_method_names = ['get']
     pagination_class = None
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
     serializer_class = IngredientSerializer
 
+    def filter_queryset(self, queryset):
+        """
+        Список ингредиентов берётся из индекса в памяти.
+        name - поиск по началу названия, search - поиск с опечатками
+        и по вхождению в середину названия.
+        """
+        if self.action != 'list':
+            return super().filter_queryset(queryset)
+        name = self.request.query_params.get('name')
+        search = self.request.query_params.get('search')
+        if search:
+            return ingredient_index.search(
+                search, settings.INGREDIENT_SEARCH_LIMIT)
+        if name:
+            return ingredient_index.startswith(
+                name, settings.INGREDIENT_SEARCH_LIMIT)
+        return ingredient_index.all()
+
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(VersionedCacheMixin, ReadOnlyModelViewSet):
     serializer_class = TagSerializer
+    data_version = TAGS_VERSION
     permission_classes = [AllowAny]
     pagination_class = None
     queryset = Tag.objects.all()
 
 
-class UserViewSet(DjoserUserViewSet):
+class UserViewSet(CursorPaginationMixin, DjoserUserViewSet):
     serializer_class = UserSerializer
     ordering = ('username',)
     queryset = User.objects.all()
     pagination_class = Pagination
+    cursor_pagination_class = UserCursorPagination
 
     @action(methods=['GET'],
             detail=False,
@@ -83,13 +187,23 @@ class UserViewSet(DjoserUserViewSet):
                 {'error': 'Аватар отсутствует'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        user.avatar.delete()
+        user.avatar = None
+        user.save(update_fields=('avatar',))
         return Response(
             {'message': 'Аватар успешно удалён'},
             status=status.HTTP_204_NO_CONTENT
         )
 
+    def get_subscription_context(self, authors):
+        """Контекст SubscriptionSerializer с рецептами всех авторов."""
+        return {
+            'request': self.request,
+            'author_recipes': group_recipes_by_author(
+                authors, get_recipes_limit(self.request)),
+        }
+
     @action(detail=True, methods=['post', 'delete'], url_path='subscribe')
+    @transaction.atomic
     def subscribe(self, request, **kwargs):
         user = request.user
         author = get_object_or_404(User, pk=self.kwargs['id'])
@@ -109,8 +223,13 @@ class UserViewSet(DjoserUserViewSet):
                     {'errors': 'Вы уже подписаны'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            User.objects.filter(pk=author.pk).update(
+                followers_count=F('followers_count') + 1)
+            TimelineEntry.objects.backfill(user, [author.pk])
+            reset_followed_ids(request)
+            author.refresh_from_db()
             serializer = SubscriptionSerializer(
-                author, context={'request': request})
+                author, context=self.get_subscription_context([author]))
             return Response(serializer.data,
                             status=status.HTTP_201_CREATED)
 
@@ -123,8 +242,32 @@ class UserViewSet(DjoserUserViewSet):
                 {'errors': 'Вы не подписаны'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        User.objects.filter(pk=author.pk).update(
+            followers_count=F('followers_count') - 1)
+        TimelineEntry.objects.prune(user, [author.pk])
+        reset_followed_ids(request)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='subscribe/batch'
+    )
+    @transaction.atomic
+    def subscribe_batch(self, request):
+        """Подписка на несколько авторов (или отписка) одним запросом."""
+        changed, results = apply_batch(
+            request, Follower, 'follow',
+            User.objects.exclude(pk=request.user.pk), 'followers_count'
+        )
+        if request.method == 'POST':
+            TimelineEntry.objects.backfill(request.user, changed)
+        else:
+            TimelineEntry.objects.prune(request.user, changed)
+        reset_followed_ids(request)
+        return Response({'results': results})
+
     @action(detail=False,
             methods=['get'],
             url_path='subscriptions',
@@ -132,19 +275,35 @@ class UserViewSet(DjoserUserViewSet):
     def subscriptions(self, request):
         authors = User.objects.filter(
             follow__user=request.user
-        )
+        ).order_by('username')
         page = self.paginate_queryset(authors)
         serializer = SubscriptionSerializer(
-            page, many=True, context={'request': request})
+            page, many=True, context=self.get_subscription_context(page))
         return self.get_paginated_response(serializer.data)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(QueryBudgetMixin, CursorPaginationMixin, ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     pagination_class = Pagination
+    cursor_pagination_class = RecipeCursorPagination
+    # Поиск сортирует по релевантности, курсор - по дате.
+    cursor_ordering_params = ('search',)
+
+    query_budget = {
+        'list': (
+            settings.RECIPE_READ_QUERY_BUDGET
+            + settings.FILTER_INDEX_QUERY_BUDGET
+        ),
+        'retrieve': settings.RECIPE_READ_QUERY_BUDGET,
+        'feed': settings.FEED_QUERY_BUDGET,
+    }
+
+    def get_queryset(self):
+        return super().get_queryset().with_related().with_user_flags(
+            self.request.user)
 
     def get_serializer_class(self):
         if self.action in ('create', 'update', 'partial_update'):
@@ -156,8 +315,21 @@ class RecipeViewSet(ModelViewSet):
         context['request'] = self.request
         return context
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=F('recipes_count') - 1)
+
+    recipe_counters = {
+        Favourite: 'favorites_count',
+        ShoppingCart: 'in_carts_count',
+    }
+
+    @transaction.atomic
     def _handle_recipe_action(self, user, recipe, model_class, action_type):
         """Общий метод для добавления/удаления рецепта в избранное/корзину."""
+        counter = self.recipe_counters[model_class]
         if action_type == 'add':
             obj, created = model_class.objects.get_or_create(
                 user=user,
@@ -168,6 +340,8 @@ class RecipeViewSet(ModelViewSet):
                     {'errors': f'уже есть{model_class._meta.verbose_name}'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            Recipe.objects.filter(pk=recipe.pk).update(
+                **{counter: F(counter) + 1})
             serializer = RecipeShortSerializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         deleted_count = model_class.objects.filter(
@@ -179,6 +353,8 @@ class RecipeViewSet(ModelViewSet):
                 {'errors': f'нету{model_class._meta.verbose_name}'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        Recipe.objects.filter(pk=recipe.pk).update(
+            **{counter: F(counter) - 1})
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -187,11 +363,101 @@ class RecipeViewSet(ModelViewSet):
         permission_classes=[IsAuthenticated],
         url_path='shopping_cart'
     )
+    @transaction.atomic
     def shopping_cart(self, request, pk=None):
         recipe = get_object_or_404(Recipe, id=pk)
         action_type = 'add' if request.method == 'POST' else 'remove'
-        return self._handle_recipe_action(
+        response = self._handle_recipe_action(
             request.user, recipe, ShoppingCart, action_type)
+        if status.is_success(response.status_code):
+            ShoppingListItem.objects.refresh(
+                [request.user.pk],
+                recipe.ingredients.values_list('ingredient_id', flat=True)
+            )
+        return response
+
+    @action(
+        detail=False,
+        methods=['get'],
+        permission_classes=[IsAuthenticated],
+    )
+    def feed(self, request):
+        """
+        Рецепты авторов из подписок, от новых к старым.
+        Читается одним проходом по индексу ленты пользователя;
+        рецепты популярных авторов, которым раскладка при записи
+        не делается, подтягиваются не чаще FEED_PULL_INTERVAL
+        в каждом процессе.
+        """
+        if caches['local'].add(
+                FEED_PULL_KEY.format(request.user.pk), True,
+                settings.FEED_PULL_INTERVAL):
+            TimelineEntry.objects.pull(request.user)
+        paginator = RecipeCursorPagination()
+        entries = paginator.paginate_queryset(
+            TimelineEntry.objects.filter(user=request.user).only(
+                'recipe_id', 'created_at'),
+            request, view=self
+        )
+        recipes = self.get_queryset().in_bulk(
+            [entry.recipe_id for entry in entries])
+        serializer = RecipeReadSerializer(
+            [recipes[entry.recipe_id] for entry in entries
+             if entry.recipe_id in recipes],
+            many=True, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='shopping_cart/batch'
+    )
+    @transaction.atomic
+    def shopping_cart_batch(self, request):
+        """Добавление рецептов в корзину (или удаление) одним запросом."""
+        changed, results = apply_batch(
+            request, ShoppingCart, 'recipes', Recipe.objects.all(),
+            self.recipe_counters[ShoppingCart]
+        )
+        if changed:
+            ShoppingListItem.objects.refresh(
+                [request.user.pk],
+                RecipeIngredient.objects.filter(
+                    recipe__in=changed
+                ).values_list('ingredient_id', flat=True)
+            )
+            transaction.on_commit(
+                partial(bump_shopping_cart_versions, [request.user.pk]))
+        return Response({'results': results})
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        permission_classes=[IsAuthenticated],
+        url_path='favorite/batch'
+    )
+    def favorite_batch(self, request):
+        """Добавление рецептов в избранное (или удаление) одним запросом."""
+        _, results = apply_batch(
+            request, Favourite, 'recipe', Recipe.objects.all(),
+            self.recipe_counters[Favourite]
+        )
+        return Response({'results': results})
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Рецепты, похожие по составу, из таблицы похожих рецептов."""
+        recipe = get_object_or_404(Recipe, pk=pk)
+        recipes = Recipe.objects.filter(
+            similar_to__recipe=recipe
+        ).annotate(
+            similarity=F('similar_to__score')
+        ).order_by('-similarity', '-id')[:settings.SIMILAR_RECIPES_LIMIT]
+        serializer = SimilarRecipeSerializer(
+            recipes, many=True, context=self.get_serializer_context())
+        return Response(serializer.data)
 
     @action(
         detail=True,
@@ -208,28 +474,36 @@ class RecipeViewSet(ModelViewSet):
         detail=False,
         methods=['get'],
         permission_classes=[IsAuthenticated],
-        url_path='download_shopping_cart'
+        url_path='download_shopping_cart',
+        renderer_classes=[PlainTextRenderer, CSVRenderer, JSONRenderer]
     )
     def download_shopping_cart(self, request):
-        ingredients = RecipeIngredient.objects.filter(
-            recipe__shopping_carts__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(
-            total_amount=Sum('amount')
-        ).order_by('ingredient__name')
-
-        content = '\n'.join(
-            [f"{item['ingredient__name']} "
-             f"({item['ingredient__measurement_unit']}) — "
-             f"{item['total_amount']}"
-             for item in ingredients]
+        """
+        Потоковая выгрузка списка покупок в формате txt, csv или json.
+        ETag зависит от строк списка покупок в БД, версий корзины
+        пользователя и справочника ингредиентов; при совпадении If-None-Match отдаётся 304.
+        """
+        export_format = request.accepted_renderer.format
+        etag = '"{}"'.format(hashlib.sha1('{}:{}:{}:{}'.format(
+            get_shopping_list_state(request.user),
+            get_version(SHOPPING_CART_VERSION.format(request.user.pk)),
+            get_version(INGREDIENTS_VERSION),
+            export_format
+        ).encode()).hexdigest())
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+            response['ETag'] = etag
+            return response
+        response = StreamingHttpResponse(
+            encode_stream(EXPORT_FORMATS[export_format](
+                get_shopping_list(request.user))),
+            content_type=(
+                f'{request.accepted_renderer.media_type}; charset=utf-8')
         )
-        response = HttpResponse(content, content_type='text/plain')
+        response['ETag'] = etag
         response['Content-Disposition'] = (
             'attachment; '
-            'filename="shopping_list.txt"'
+            f'filename="shopping_list.{export_format}"'
         )
         return response
 
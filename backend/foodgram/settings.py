@@ -27,10 +27,12 @@ INSTALLED_APPS = [
     'djoser',
     'users.apps.UserConfig',
     'recipes.apps.RecipeConfig',
+    'jobs.apps.JobsConfig',
     'api.apps.ApiConfig',
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +74,34 @@ DATABASES = {
     }
 }
 
+# Версии данных и журнал изменений (recipes.versions) должны быть
+# общими для всех процессов gunicorn, воркера и management-команд,
+# поэтому кэш хранится в БД. Таблицу создаёт команда createcachetable
+# (см. README). Процессы сверяются с ним не чаще
+# DATA_VERSION_CHECK_INTERVAL секунд.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+    # Готовые ответы справочников (api.mixins.VersionedCacheMixin):
+    # ключ содержит версию данных, поэтому кэш может быть у каждого
+    # процесса своим и не вытесняет версии из общего.
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    # Отметки, которым достаточно быть своими у каждого процесса
+    # (когда лента пользователя последний раз подтягивалась):
+    # запись в DatabaseCache стоила бы нескольких запросов на чтение.
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'local',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -103,6 +133,15 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = BASE_DIR / 'media'
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.FoodgramUser'
@@ -134,3 +173,61 @@ CSRF_TRUSTED_ORIGINS = [
 
 DEFAULT_PAGE_SIZE = 5
 MAX_PAGE_SIZE = 20
+
+RECIPE_READ_QUERY_BUDGET = 7
+# Сверка индексов фильтров (api.search) с общим кэшем и их
+# обновление: версии, записи журнала и перечитанные рецепты.
+FILTER_INDEX_QUERY_BUDGET = 3
+
+INGREDIENT_SEARCH_LIMIT = 50
+TRIGRAM_SIMILARITY = 0.3
+
+RESPONSE_CACHE_TIMEOUT = 60 * 60 * 24
+EXPORT_CHUNK_SIZE = 2000
+
+RECIPE_IMAGE_RENDITIONS = {
+    'thumbnail': {'width': 480, 'height': 320, 'crop': True},
+    'full': {'width': 1600, 'height': 1600, 'crop': False},
+}
+AVATAR_RENDITIONS = {
+    'thumbnail': {'width': 96, 'height': 96, 'crop': True},
+    'full': {'width': 512, 'height': 512, 'crop': False},
+}
+IMAGE_RENDITION_QUALITY = 80
+
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_BACKOFF = 10
+JOB_LOCK_TIMEOUT = 60 * 10
+JOB_HEARTBEAT_INTERVAL = 60
+JOB_POLL_INTERVAL = 1
+
+BATCH_MAX_IDS = 100
+
+FEED_FANOUT_LIMIT = 10000
+FEED_FANOUT_BATCH_SIZE = 1000
+FEED_BACKFILL_LIMIT = 50
+FEED_PULL_INTERVAL = 60
+# Чтение ленты плюс подтягивание рецептов популярных авторов
+# (раз в FEED_PULL_INTERVAL в каждом процессе).
+FEED_QUERY_BUDGET = RECIPE_READ_QUERY_BUDGET + 3
+
+SIMILAR_RECIPES_LIMIT = 10
+SIMILAR_MIN_SCORE = 0.2
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 32
+
+DATA_VERSION_CHECK_INTERVAL = 5
+DATA_CHANGES_LIMIT = 1000
+DATA_CHANGES_TIMEOUT = 60 * 60
+
+# Общий каталог для метрик процессов gunicorn; без него /metrics
+# отдаёт метрики только обработавшего запрос процесса.
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 5
+METRICS_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+METRICS_QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+METRICS_SIZE_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304
+)
@@ -0,0 +1,27 @@
+from django.contrib import admin
+from django.utils import timezone
+
+from jobs.models import Job
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'id', 'task', 'status', 'attempts', 'max_attempts', 'run_at',
+        'created_at'
+    )
+    list_display_links = ('id', 'task')
+    search_fields = ('task',)
+    list_filter = ('status', 'task')
+    readonly_fields = ('attempts', 'locked_at', 'last_error', 'created_at')
+    actions = ('retry',)
+    list_per_page = 25
+
+    @admin.action(description='Повторить выбранные задачи')
+    def retry(self, request, queryset):
+        queryset.update(
+            status=Job.Status.QUEUED,
+            attempts=0,
+            locked_at=None,
+            run_at=timezone.now(),
+        )
@@ -0,0 +1,76 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from jobs.queue import claim, run
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди в БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Сколько задач выполнять одновременно'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float,
+            default=settings.JOB_POLL_INTERVAL,
+            help='Пауза в секундах, если очередь пуста'
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Выполнить готовые задачи и завершиться'
+        )
+
+    def work(self, stopping, poll_interval, burst):
+        done = failed = 0
+        try:
+            while not stopping.is_set():
+                close_old_connections()
+                job = claim()
+                if job is None:
+                    if burst:
+                        break
+                    stopping.wait(poll_interval)
+                    continue
+                if run(job):
+                    done += 1
+                else:
+                    failed += 1
+        finally:
+            connection.close()
+        with self.lock:
+            self.done += done
+            self.failed += failed
+
+    def stop(self, signum, frame):
+        self.stdout.write('Завершение после текущих задач...')
+        self.stopping.set()
+
+    def handle(self, *args, **options):
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.done = self.failed = 0
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        threads = [
+            threading.Thread(
+                target=self.work,
+                args=(
+                    self.stopping, options['poll_interval'],
+                    options['burst']
+                ),
+                name=f'worker-{number}',
+            )
+            for number in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.stdout.write(self.style.SUCCESS(
+            f'Выполнено задач: {self.done}, с ошибкой: {self.failed}'))
@@ -0,0 +1,94 @@
+from datetime import timedelta
+
+from django.db import models
+from django.utils import timezone
+
+MAX_LENGTH_TASK = 255
+
+
+class JobQuerySet(models.QuerySet):
+    """Запросы к очереди задач."""
+
+    def ready(self, lock_timeout):
+        """
+        Задачи, которые можно взять в работу: ожидающие, чьё время
+        подошло, и выполняемые, чей обработчик не продлевал locked_at
+        дольше lock_timeout секунд (считается упавшим).
+        """
+        now = timezone.now()
+        return self.filter(
+            models.Q(status=Job.Status.QUEUED, run_at__lte=now)
+            | models.Q(
+                status=Job.Status.RUNNING,
+                locked_at__lt=now - timedelta(seconds=lock_timeout)
+            )
+        )
+
+
+class Job(models.Model):
+    """Фоновая задача. Успешно выполненные задачи удаляются."""
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        FAILED = 'failed', 'Ошибка'
+
+    task = models.CharField(
+        max_length=MAX_LENGTH_TASK,
+        verbose_name='Задача'
+    )
+    args = models.JSONField(
+        default=list,
+        blank=True,
+        verbose_name='Позиционные аргументы'
+    )
+    kwargs = models.JSONField(
+        default=dict,
+        blank=True,
+        verbose_name='Именованные аргументы'
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=Status.choices,
+        default=Status.QUEUED,
+        verbose_name='Статус'
+    )
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Попыток'
+    )
+    max_attempts = models.PositiveSmallIntegerField(
+        verbose_name='Максимум попыток'
+    )
+    run_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Выполнить не раньше'
+    )
+    locked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Взята в работу'
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name='Последняя ошибка'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+
+    objects = JobQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('run_at', 'id')
+        verbose_name = 'Задача'
+        verbose_name_plural = 'Задачи'
+        indexes = [
+            models.Index(
+                fields=['status', 'run_at'], name='job_status_run_at_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.task} #{self.pk}'
@@ -0,0 +1,161 @@
+"""
+Очередь фоновых задач в основной БД проекта.
+
+Задача - функция, зарегистрированная декоратором task в модуле
+tasks.py любого приложения. Вызов func.delay(...) добавляет строку
+Job в текущей транзакции, поэтому задача появится в очереди только
+вместе с данными, которые её породили. Задачи выполняет команда
+run_worker.
+"""
+import logging
+import threading
+import traceback
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+def task(func=None, *, max_attempts=None):
+    """Регистрирует функцию как фоновую задачу и добавляет ей delay."""
+    if func is None:
+        return partial(task, max_attempts=max_attempts)
+    name = f'{func.__module__}.{func.__qualname__}'
+    registry[name] = func
+    func.delay = partial(enqueue, name, max_attempts=max_attempts)
+    return func
+
+
+def enqueue(name, *args, max_attempts=None, run_at=None, **kwargs):
+    """Ставит задачу name в очередь, аргументы должны приводиться к JSON."""
+    if name not in registry:
+        raise LookupError(f'Задача {name} не зарегистрирована')
+    return Job.objects.create(
+        task=name,
+        args=list(args),
+        kwargs=kwargs,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=run_at or timezone.now(),
+    )
+
+
+def claim():
+    """
+    Берёт в работу одну готовую задачу и возвращает её или None.
+    На PostgreSQL строка выбирается через FOR UPDATE SKIP LOCKED,
+    и обработчики не ждут друг друга. SQLite не умеет блокировать
+    строки, а транзакция с чтением перед записью там сразу падает
+    с database is locked, поэтому захват держится на условном UPDATE
+    вне транзакции: если задачу успел взять другой обработчик,
+    строка не обновится и выбирается следующая.
+    """
+    lock_timeout = settings.JOB_LOCK_TIMEOUT
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    while True:
+        with transaction.atomic() if skip_locked else nullcontext():
+            queryset = Job.objects.ready(lock_timeout).order_by(
+                'run_at', 'id')
+            if skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            job = queryset.first()
+            if job is None:
+                return None
+            claimed = Job.objects.ready(lock_timeout).filter(
+                pk=job.pk
+            ).update(
+                status=Job.Status.RUNNING,
+                locked_at=timezone.now(),
+                attempts=F('attempts') + 1,
+            )
+        if claimed:
+            job.refresh_from_db()
+            return job
+
+
+def get_retry_delay(attempts):
+    """Экспоненциальная задержка перед повтором, в секундах."""
+    return settings.JOB_RETRY_BACKOFF * 2 ** (attempts - 1)
+
+
+@contextmanager
+def heartbeat(job):
+    """
+    Пока задача выполняется, раз в JOB_HEARTBEAT_INTERVAL секунд
+    обновляет её locked_at из отдельного потока. Задачу, чей
+    locked_at старше JOB_LOCK_TIMEOUT, обработчик уже не выполняет,
+    и её берёт другой.
+    """
+    stopped = threading.Event()
+
+    def beat():
+        try:
+            while not stopped.wait(settings.JOB_HEARTBEAT_INTERVAL):
+                try:
+                    Job.objects.filter(
+                        pk=job.pk,
+                        status=Job.Status.RUNNING,
+                        attempts=job.attempts,
+                    ).update(locked_at=timezone.now())
+                except DatabaseError:
+                    logger.warning(
+                        'Не удалось продлить задачу %s', job, exc_info=True)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(
+        target=beat, name=f'heartbeat-{job.pk}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run(job):
+    """
+    Выполняет задачу. Успешная задача удаляется из очереди, упавшая
+    откладывается на get_retry_delay секунд, а после max_attempts
+    попыток остаётся в статусе failed. Итог записывается только если
+    задачу не успел перехватить другой обработчик: тот увеличил
+    attempts, и запись этого обработчика уже не совпадает.
+    """
+    func = registry.get(job.task)
+    owned = Job.objects.filter(pk=job.pk, attempts=job.attempts)
+    try:
+        if func is None:
+            raise LookupError(f'Задача {job.task} не зарегистрирована')
+        with heartbeat(job):
+            func(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            delay = get_retry_delay(job.attempts)
+            logger.warning(
+                'Задача %s упала, повтор через %d с', job, delay)
+            owned.update(
+                status=Job.Status.QUEUED,
+                locked_at=None,
+                last_error=error,
+                run_at=timezone.now() + timedelta(seconds=delay),
+            )
+        else:
+            logger.error('Задача %s не выполнена:\n%s', job, error)
+            owned.update(
+                status=Job.Status.FAILED,
+                locked_at=None,
+                last_error=error,
+            )
+        return False
+    owned.delete()
+    return True
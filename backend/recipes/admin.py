@@ -1,34 +1,61 @@
+from functools import partial
+
 from django.contrib import admin
 from django.contrib.auth import get_user_model
-from django.db.models import Count
+from django.db import transaction
 
 from recipes.models import (Recipe,
                             Ingredient,
                             Tag,
                             Favourite,
                             RecipeIngredient,
-                            ShoppingCart)
+                            ShoppingCart,
+                            ShoppingListItem)
+from recipes.versions import (
+    RECIPE_INGREDIENTS_VERSION, bump_shopping_cart_versions, log_changes
+)
 User = get_user_model()
 
 
+def refresh_carts(carts):
+    """Пересчитывает списки покупок владельцев корзин carts."""
+    user_ids = {cart.user_id for cart in carts}
+    ShoppingListItem.objects.refresh(
+        user_ids,
+        RecipeIngredient.objects.filter(
+            recipe__in={cart.recipes_id for cart in carts}
+        ).values_list('ingredient_id', flat=True)
+    )
+    transaction.on_commit(partial(bump_shopping_cart_versions, user_ids))
+
+
+def refresh_recipe_ingredients(links):
+    """
+    Пересчитывает списки покупок с рецептами связей links
+    по их ингредиентам.
+    """
+    user_ids = set(ShoppingCart.objects.filter(
+        recipes__in={link.recipe_id for link in links}
+    ).values_list('user_id', flat=True))
+    ShoppingListItem.objects.refresh(
+        user_ids, {link.ingredient_id for link in links})
+    transaction.on_commit(partial(bump_shopping_cart_versions, user_ids))
+
+
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author', 'favorites_count', 'cooking_time')
+    list_display = (
+        'id', 'name', 'author', 'favorites_count', 'in_carts_count',
+        'cooking_time'
+    )
     list_display_links = ('id', 'name')
     search_fields = ('name', 'author__username', 'author__email')
     list_filter = ('tags',)
     filter_horizontal = ('tags',)
-    readonly_fields = ('favorites_count',)
+    readonly_fields = ('favorites_count', 'in_carts_count')
+    list_select_related = ('author',)
     list_per_page = 25
 
-    def get_queryset(self, request):
-        queryset = super().get_queryset(request)
-        return queryset.annotate(favorites_count=Count('favourite'))
-
-    @admin.display(description='В избранном', ordering='favorites_count')
-    def favorites_count(self, obj):
-        return obj.favorites_count
-
 
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
@@ -63,6 +90,28 @@ class RecipeIngredientAdmin(admin.ModelAdmin):
     search_fields = ('recipe__name', 'ingredient__name')
     list_per_page = 25
 
+    def save_model(self, request, obj, form, change):
+        links = [obj]
+        if change:
+            links.append(RecipeIngredient.objects.get(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+        refresh_recipe_ingredients(links)
+
+    def delete_queryset(self, request, queryset):
+        links = list(queryset)
+        super().delete_queryset(request, queryset)
+        refresh_recipe_ingredients(links)
+        transaction.on_commit(partial(
+            log_changes, RECIPE_INGREDIENTS_VERSION,
+            {link.recipe_id for link in links}
+        ))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_recipe_ingredients([obj])
+        transaction.on_commit(partial(
+            log_changes, RECIPE_INGREDIENTS_VERSION, [obj.recipe_id]))
+
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
@@ -70,3 +119,27 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_display_links = ('id', 'user')
     search_fields = ('user__username', 'recipes__name')
     list_per_page = 25
+
+    def save_model(self, request, obj, form, change):
+        carts = [obj]
+        if change:
+            carts.append(ShoppingCart.objects.get(pk=obj.pk))
+        super().save_model(request, obj, form, change)
+        refresh_carts(carts)
+
+    def delete_queryset(self, request, queryset):
+        carts = list(queryset)
+        super().delete_queryset(request, queryset)
+        refresh_carts(carts)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        refresh_carts([obj])
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'total_amount')
+    list_display_links = ('id', 'user')
+    search_fields = ('user__username', 'ingredient__name')
+    list_per_page = 25
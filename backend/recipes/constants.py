@@ -7,5 +7,7 @@ MAX_LENGTH_TEXT = 800
 MIN_COOKING_TIME = 1
 MIN_AMOUNT_VAL = 1
 MAX_COOKTIME_VAL = 32767
+# Тегам с id от 1 до MAX_TAG_BITS соответствуют биты Recipe.tags_mask.
+MAX_TAG_BITS = 63
 SELF_SUBSCRIBE_ERROR = "Вы не можете подписаться на себя"
 UNIQUE_SHOPPING_CART_ERROR = "Рецепт уже в корзине"
@@ -0,0 +1,150 @@
+"""
+Полнотекстовый поиск рецептов по названию и описанию.
+
+PostgreSQL: генерируемая колонка tsvector с русской морфологией
+и GIN-индекс, СУБД сама обновляет её при изменении рецепта.
+SQLite: внешняя таблица FTS5 и триггеры, синхронизирующие её
+с recipes_recipe. Русского стеммера в FTS5 нет, поэтому слова
+запроса укорачиваются и ищутся по префиксу.
+"""
+import re
+
+from django.db import models
+from django.db.models.expressions import RawSQL
+
+TABLE = 'recipes_recipe'
+FTS_TABLE = 'recipes_recipe_fts'
+WORD_RE = re.compile(r'\w+')
+
+POSTGRES_CREATE = (
+    f"ALTER TABLE {TABLE} ADD COLUMN search_vector tsvector "
+    f"GENERATED ALWAYS AS ("
+    f"setweight(to_tsvector('russian', name), 'A') || "
+    f"setweight(to_tsvector('russian', text), 'B')) STORED",
+    f"CREATE INDEX {TABLE}_search_vector_idx ON {TABLE} "
+    f"USING GIN (search_vector)",
+)
+POSTGRES_DROP = (
+    f"DROP INDEX IF EXISTS {TABLE}_search_vector_idx",
+    f"ALTER TABLE {TABLE} DROP COLUMN IF EXISTS search_vector",
+)
+SQLITE_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"name, text, content='{TABLE}', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')"
+)
+SQLITE_TRIGGERS = {
+    f'{FTS_TABLE}_insert': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_insert "
+        f"AFTER INSERT ON {TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, name, text) "
+        f"VALUES (new.id, new.name, new.text); END"
+    ),
+    f'{FTS_TABLE}_delete': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_delete "
+        f"AFTER DELETE ON {TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text) "
+        f"VALUES ('delete', old.id, old.name, old.text); END"
+    ),
+    f'{FTS_TABLE}_update': (
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_update "
+        f"AFTER UPDATE OF name, text ON {TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, text) "
+        f"VALUES ('delete', old.id, old.name, old.text); "
+        f"INSERT INTO {FTS_TABLE}(rowid, name, text) "
+        f"VALUES (new.id, new.name, new.text); END"
+    ),
+}
+
+
+def create_index(connection):
+    """Создаёт индекс полнотекстового поиска для текущей СУБД."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_CREATE:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            ensure_sqlite_index(connection)
+
+
+def drop_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            for sql in POSTGRES_DROP:
+                cursor.execute(sql)
+        elif connection.vendor == 'sqlite':
+            for name in SQLITE_TRIGGERS:
+                cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+def ensure_sqlite_index(connection):
+    """
+    Создаёт недостающие таблицу FTS5 и триггеры.
+    SQLite пересоздаёт recipes_recipe при изменении её схемы, и
+    триггеры удаляются вместе со старой таблицей, поэтому проверка
+    выполняется после каждой миграции; если триггеров не было,
+    индекс перестраивается целиком.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+            "AND tbl_name = %s", [TABLE]
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        if existing >= SQLITE_TRIGGERS.keys():
+            return
+        cursor.execute(SQLITE_TABLE)
+        for sql in SQLITE_TRIGGERS.values():
+            cursor.execute(sql)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def get_sqlite_query(query):
+    """Запрос FTS5: каждое слово без окончания, с поиском по префиксу."""
+    terms = []
+    for word in WORD_RE.findall(query.casefold()):
+        if len(word) > 4:
+            word = word[:max(4, len(word) - 2)]
+        terms.append(f'"{word}"*')
+    return ' '.join(terms)
+
+
+def search(queryset, query, connection):
+    """
+    Рецепты, подходящие под query, с релевантностью search_rank,
+    отсортированные от более релевантных к менее.
+    """
+    if connection.vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('russian', %s)"
+        queryset = queryset.annotate(
+            search_rank=RawSQL(
+                f'ts_rank({TABLE}.search_vector, {tsquery})',
+                (query,), output_field=models.FloatField()
+            )
+        ).filter(RawSQL(
+            f'{TABLE}.search_vector @@ {tsquery}',
+            (query,), output_field=models.BooleanField()
+        ))
+    elif connection.vendor == 'sqlite':
+        fts_query = get_sqlite_query(query)
+        if not fts_query:
+            return queryset.none()
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            (fts_query,)
+        )).annotate(
+            search_rank=RawSQL(
+                f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s AND rowid = {TABLE}.id',
+                (fts_query,), output_field=models.FloatField()
+            )
+        )
+    else:
+        queryset = queryset.annotate(
+            search_rank=models.Value(0.0)
+        ).filter(
+            models.Q(name__icontains=query) | models.Q(text__icontains=query)
+        )
+    return queryset.order_by('-search_rank', '-created_at', '-id')
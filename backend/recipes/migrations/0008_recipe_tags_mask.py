@@ -0,0 +1,42 @@
+# Generated by Django 4.2.16 on 2026-10-18 03:21
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+MAX_TAG_BITS = 63
+BATCH_SIZE = 500
+
+
+def fill_tags_mask(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    masks = defaultdict(int)
+    for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+            'recipe_id', 'tag_id').iterator():
+        if 0 < tag_id <= MAX_TAG_BITS:
+            masks[recipe_id] |= 1 << (tag_id - 1)
+    # Разных масок немного: один UPDATE на маску и порцию рецептов.
+    recipes = defaultdict(list)
+    for recipe_id, mask in masks.items():
+        recipes[mask].append(recipe_id)
+    for mask, recipe_ids in recipes.items():
+        for start in range(0, len(recipe_ids), BATCH_SIZE):
+            Recipe.objects.filter(
+                pk__in=recipe_ids[start:start + BATCH_SIZE]
+            ).update(tags_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_similarrecipe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tags_mask',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Биты тегов'),
+        ),
+        migrations.RunPython(fill_tags_mask, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,17 @@
+import json
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 from django.contrib.auth import get_user_model
 
+from users.models import Follower
+
+from . import fulltext
 from .constants import (
     MAX_LENGTH_NAME_TAG,
     MAX_LENGTH_SLUG_TAG,
@@ -12,11 +22,112 @@ from .constants import (
     MIN_COOKING_TIME,
     MIN_AMOUNT_VAL,
     MAX_COOKTIME_VAL,
+    MAX_TAG_BITS,
 )
 
 User = get_user_model()
 
 
+def get_tag_bit(tag_id):
+    """Бит тега в Recipe.tags_mask; у тегов с id больше MAX_TAG_BITS - 0."""
+    return 1 << (tag_id - 1) if 0 < tag_id <= MAX_TAG_BITS else 0
+
+
+def get_tags_mask(tag_ids):
+    return reduce(or_, map(get_tag_bit, tag_ids), 0)
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Запросы к рецептам."""
+
+    def with_related(self):
+        """Подгружает автора, теги и ингредиенты для сериализации."""
+        return self.select_related('author').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')
+            ),
+        )
+
+    def latest_by_author(self, authors, limit=None):
+        """Последние рецепты авторов: не более limit на каждого автора."""
+        queryset = self.filter(author__in=authors)
+        if limit is None:
+            return queryset.order_by('author', '-created_at')
+        return queryset.annotate(
+            row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=models.F('author'),
+                order_by=(
+                    models.F('created_at').desc(), models.F('id').desc()
+                ),
+            )
+        ).filter(row_number__lte=limit).order_by('author', 'row_number')
+
+    def with_ids(self, ids, exclude=False):
+        """
+        Рецепты с id из ids, а при exclude - все остальные. Список
+        передаётся одним параметром запроса, поэтому его длина не
+        упирается в лимит параметров SQLite и не раздувает текст запроса.
+        """
+        ids = list(ids)
+        if not ids:
+            return self if exclude else self.none()
+        vendor = connections[self.db].vendor
+        if vendor == 'postgresql':
+            condition = RawSQL(
+                f'{self.model._meta.db_table}.id = ANY(%s)', (ids,),
+                output_field=models.BooleanField()
+            )
+        elif vendor == 'sqlite':
+            condition = models.Q(pk__in=RawSQL(
+                'SELECT value FROM json_each(%s)', (json.dumps(ids),)))
+        else:
+            condition = models.Q(pk__in=ids)
+        return self.exclude(condition) if exclude else self.filter(condition)
+
+    def with_any_tag(self, tag_ids):
+        """
+        Рецепты хотя бы с одним из тегов tag_ids.
+        Условие tags_mask & mask <> 0 проверяется по Recipe.tags_mask
+        без соединения с таблицами тегов; теги без бита ищутся через
+        соединение. Индекса под условие нет: B-tree не ищет по
+        побитовому И с произвольной маской, поэтому рецепты читаются
+        по индексу created_at в порядке выдачи, а маска проверяется
+        у каждой строки.
+        """
+        bits = [get_tag_bit(tag_id) for tag_id in tag_ids]
+        if not all(bits):
+            return self.filter(tags__in=tag_ids).distinct()
+        return self.alias(
+            matched_tags=models.F('tags_mask').bitand(reduce(or_, bits))
+        ).exclude(matched_tags=0)
+
+    def search(self, query):
+        """Полнотекстовый поиск по названию и описанию рецепта."""
+        return fulltext.search(self, query, connections[self.db])
+
+    def with_user_flags(self, user):
+        """Аннотирует флаги избранного и корзины для пользователя."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(False),
+                is_in_shopping_cart=models.Value(False),
+            )
+        return self.annotate(
+            is_favorited=models.Exists(
+                Favourite.objects.filter(
+                    user=user, recipe=models.OuterRef('pk'))
+            ),
+            is_in_shopping_cart=models.Exists(
+                ShoppingCart.objects.filter(
+                    user=user, recipes=models.OuterRef('pk'))
+            ),
+        )
+
+
 class Tag(models.Model):
     """Класс тега."""
     name = models.CharField(
@@ -83,6 +194,13 @@ class Recipe(models.Model):
         verbose_name='Фото',
         upload_to='recipes/images'
     )
+    image_renditions = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        editable=False,
+        verbose_name='Варианты фото созданы для',
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='время на приготовление',
         validators=[
@@ -94,11 +212,28 @@ class Recipe(models.Model):
         Tag,
         verbose_name='Тег'
     )
+    tags_mask = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Биты тегов',
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name='Дата создания',
         db_index=True
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок',
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ('-created_at',)
@@ -182,3 +317,246 @@ class ShoppingCart(models.Model):
 
     def __str__(self):
         return f'{self.user.username} - {self.recipes.name}'
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    """Запросы к сводным спискам покупок."""
+
+    def live_totals(self, user_ids=None, ingredient_ids=None):
+        """Суммы ингредиентов по корзинам, посчитанные по рецептам."""
+        # Все условия на корзины в одном filter(), иначе Django
+        # присоединит shopping_carts несколько раз и суммы умножатся.
+        lookups = {'recipe__shopping_carts__user__isnull': False}
+        if user_ids is not None:
+            lookups['recipe__shopping_carts__user__in'] = user_ids
+        if ingredient_ids is not None:
+            lookups['ingredient__in'] = ingredient_ids
+        return RecipeIngredient.objects.filter(**lookups).values_list(
+            'recipe__shopping_carts__user', 'ingredient'
+        ).annotate(
+            total_amount=models.Sum('amount')
+        ).order_by()
+
+    def refresh(self, user_ids, ingredient_ids):
+        """
+        Пересчитывает строки пользователей user_ids по ингредиентам
+        ingredient_ids. Вызывается внутри транзакции, изменившей
+        корзины или состав рецептов. Строки пользователей блокируются
+        до конца транзакции: иначе два параллельных пересчёта удалят
+        строки и оба вставят их заново, а второй упадёт на
+        unique_shopping_list_item.
+        """
+        user_ids, ingredient_ids = list(user_ids), list(ingredient_ids)
+        if not user_ids or not ingredient_ids:
+            return
+        list(User.objects.select_for_update().filter(
+            pk__in=user_ids
+        ).order_by('pk').values_list('pk', flat=True))
+        self.filter(
+            user__in=user_ids, ingredient__in=ingredient_ids
+        ).delete()
+        self.bulk_create(
+            self.model(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total_amount
+            )
+            for user_id, ingredient_id, total_amount in self.live_totals(
+                user_ids, ingredient_ids)
+        )
+
+
+class ShoppingListItem(models.Model):
+    """
+    Строка сводного списка покупок пользователя.
+    Хранит сумму ингредиента по всем рецептам в корзине, чтобы
+    выгрузка списка была одним чтением по индексу.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+    )
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списков покупок'
+
+    def __str__(self):
+        return f'{self.user.username} - {self.ingredient.name}'
+
+
+class TimelineEntryQuerySet(models.QuerySet):
+    """
+    Запросы к лентам подписок.
+    Новый рецепт раскладывается по лентам подписчиков при записи
+    (fan_out). У авторов с числом подписчиков больше FEED_FANOUT_LIMIT
+    раскладка не делается: их рецепты подтягивает в ленту сам
+    читатель при чтении (pull).
+    """
+
+    def add_recipes(self, user_ids, recipes):
+        """Добавляет рецепты (id, author_id, created_at) в ленты."""
+        # Список, а не генератор: пустой генератор bulk_create
+        # не распознаёт и открывает ради него транзакцию.
+        entries = [
+            self.model(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                created_at=created_at
+            )
+            for user_id in user_ids
+            for recipe_id, author_id, created_at in recipes
+        ]
+        self.bulk_create(entries, ignore_conflicts=True)
+
+    def fan_out(self, recipe_ids):
+        """Раскладывает рецепты по лентам подписчиков авторов."""
+        recipes = Recipe.objects.filter(
+            pk__in=recipe_ids,
+            author__followers_count__lte=settings.FEED_FANOUT_LIMIT
+        ).values_list('pk', 'author_id', 'created_at')
+        batch_size = settings.FEED_FANOUT_BATCH_SIZE
+        for recipe in recipes:
+            followers = Follower.objects.filter(
+                follow=recipe[1]
+            ).values_list('user_id', flat=True).iterator(
+                chunk_size=batch_size)
+            batch = []
+            for user_id in followers:
+                batch.append(user_id)
+                if len(batch) == batch_size:
+                    self.add_recipes(batch, [recipe])
+                    batch = []
+            self.add_recipes(batch, [recipe])
+
+    def backfill(self, user, author_ids):
+        """Добавляет в ленту последние рецепты новых авторов подписки."""
+        self.add_recipes([user.pk], Recipe.objects.latest_by_author(
+            author_ids, settings.FEED_BACKFILL_LIMIT
+        ).values_list('pk', 'author_id', 'created_at'))
+
+    def prune(self, user, author_ids):
+        """Убирает из ленты рецепты авторов, от которых user отписался."""
+        self.filter(user=user, author__in=author_ids).delete()
+
+    def pull(self, user):
+        """Подтягивает в ленту рецепты популярных авторов подписки."""
+        self.backfill(user, Follower.objects.filter(
+            user=user,
+            follow__followers_count__gt=settings.FEED_FANOUT_LIMIT
+        ).values_list('follow_id', flat=True))
+
+
+class TimelineEntry(models.Model):
+    """
+    Рецепт в ленте подписок пользователя.
+    Дата рецепта скопирована сюда, чтобы лента читалась одним
+    проходом по индексу (user, -created_at, -id).
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Читатель',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Дата рецепта',
+    )
+
+    objects = TimelineEntryQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                'user', models.F('created_at').desc(), models.F('id').desc(),
+                name='timeline_user_created_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'], name='timeline_user_author_idx'
+            ),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+
+    def __str__(self):
+        return f'{self.user_id} - {self.recipe_id}'
+
+
+class SimilarRecipe(models.Model):
+    """
+    Похожий рецепт: коэффициент Жаккара множеств ингредиентов.
+    Таблицу строит команда build_similar_recipes и дополняет
+    фоновая задача при изменении состава рецептов.
+    """
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(
+        verbose_name='Сходство',
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                'recipe', models.F('score').desc(),
+                name='similar_recipe_score_idx'
+            ),
+        ]
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+
+    def __str__(self):
+        return f'{self.recipe_id} ~ {self.similar_id}: {self.score:.2f}'
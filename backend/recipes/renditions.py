@@ -0,0 +1,74 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+
+def get_rendition_name(name, kind):
+    """Имя файла варианта kind рядом с оригиналом name."""
+    return f'{os.path.splitext(name)[0]}.{kind}.webp'
+
+
+def render(image, width, height, crop):
+    if crop:
+        return ImageOps.fit(image, (width, height), Image.LANCZOS)
+    image = image.copy()
+    image.thumbnail((width, height), Image.LANCZOS)
+    return image
+
+
+def renditions_ready(field_file):
+    """
+    Созданы ли варианты изображения field_file. Проверяется по полю
+    <имя поля>_renditions модели, без обращения к хранилищу.
+    """
+    return bool(field_file) and getattr(
+        field_file.instance, f'{field_file.field.name}_renditions', None
+    ) == field_file.name
+
+
+def mark_renditions_ready(instance, field):
+    """
+    Отмечает, что варианты изображения из поля field созданы.
+    Отметка не ставится, если изображение успели заменить.
+    """
+    name = getattr(instance, field).name
+    type(instance).objects.filter(pk=instance.pk, **{field: name}).update(
+        **{f'{field}_renditions': name})
+
+
+def create_renditions(field_file, renditions, force=False):
+    """
+    Сохраняет WebP-варианты изображения field_file рядом с оригиналом.
+    renditions - словарь kind -> {'width', 'height', 'crop'}.
+    Уже существующие варианты пропускаются, если не задан force.
+    Возвращает имена созданных файлов.
+    """
+    if not field_file:
+        return []
+    storage = field_file.storage
+    missing = {
+        kind: spec for kind, spec in renditions.items()
+        if force or not storage.exists(
+            get_rendition_name(field_file.name, kind))
+    }
+    if not missing:
+        return []
+    with storage.open(field_file.name, 'rb') as source:
+        image = ImageOps.exif_transpose(Image.open(source))
+        image = image.convert(
+            'RGBA' if 'A' in image.getbands() else 'RGB')
+    created = []
+    for kind, spec in missing.items():
+        buffer = BytesIO()
+        render(
+            image, spec['width'], spec['height'], spec['crop']
+        ).save(buffer, 'WEBP', quality=settings.IMAGE_RENDITION_QUALITY)
+        name = get_rendition_name(field_file.name, kind)
+        if storage.exists(name):
+            storage.delete(name)
+        save = getattr(storage, 'save_as', storage.save)
+        created.append(save(name, ContentFile(buffer.getvalue())))
+    return created
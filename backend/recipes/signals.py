@@ -0,0 +1,138 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete
+)
+from django.dispatch import receiver
+
+from . import fulltext
+from .models import (
+    Ingredient, Recipe, RecipeIngredient, ShoppingCart, ShoppingListItem,
+    Tag, get_tag_bit, get_tags_mask
+)
+from .renditions import renditions_ready
+from .tasks import (
+    create_avatar_renditions, create_recipe_image_renditions
+)
+from .versions import (
+    INGREDIENTS_VERSION, RECIPE_INGREDIENTS_VERSION, TAGS_VERSION,
+    bump_shopping_cart_versions, bump_version, log_changes
+)
+
+User = get_user_model()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_ingredients_version(**kwargs):
+    transaction.on_commit(partial(bump_version, INGREDIENTS_VERSION))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tags_version(**kwargs):
+    transaction.on_commit(partial(bump_version, TAGS_VERSION))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_tags_mask(instance, action, reverse, pk_set, **kwargs):
+    """
+    Поддерживает Recipe.tags_mask при изменении тегов рецепта.
+    Если маска рецепта в памяти уже учитывает изменение (сериализатор
+    считает её заранее и сохраняет вместе с рецептом), запроса нет.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        recipes = Recipe.objects.all()
+        if action != 'post_clear':
+            recipes = recipes.filter(pk__in=pk_set)
+        mask = get_tag_bit(instance.pk)
+    else:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+        mask = -1 if action == 'post_clear' else get_tags_mask(pk_set)
+        old_mask = instance.tags_mask
+        if action == 'post_add':
+            instance.tags_mask |= mask
+        else:
+            instance.tags_mask &= ~mask
+        if instance.tags_mask == old_mask:
+            return
+    if not mask:
+        return
+    if action == 'post_add':
+        recipes.update(tags_mask=F('tags_mask').bitor(mask))
+        return
+    if reverse:
+        recipes = recipes.alias(
+            matched_tags=F('tags_mask').bitand(mask)
+        ).filter(matched_tags__gt=0)
+    recipes.update(tags_mask=F('tags_mask').bitand(~mask))
+
+
+@receiver(post_delete, sender=Tag)
+def clear_tag_bit(instance, **kwargs):
+    """Связи с удалённым тегом удаляются без m2m_changed."""
+    update_tags_mask(instance, 'post_clear', True, None)
+
+
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def bump_shopping_cart_version(instance, **kwargs):
+    transaction.on_commit(
+        partial(bump_shopping_cart_versions, [instance.user_id]))
+
+
+def refresh_shopping_lists(user_ids, ingredient_ids):
+    with transaction.atomic():
+        ShoppingListItem.objects.refresh(user_ids, ingredient_ids)
+
+
+@receiver(pre_delete, sender=Recipe)
+def refresh_shopping_lists_on_recipe_delete(instance, **kwargs):
+    """
+    Рецепт удаляется вместе с корзинами, в которые он добавлен,
+    в том числе из админки и каскадом при удалении автора. Списки
+    покупок пересчитываются после коммита, когда удалены все связи;
+    версии корзин затем увеличивает bump_shopping_cart_version.
+    """
+    user_ids = list(
+        instance.shopping_carts.values_list('user_id', flat=True))
+    if user_ids:
+        transaction.on_commit(partial(
+            refresh_shopping_lists, user_ids,
+            list(instance.ingredients.values_list(
+                'ingredient_id', flat=True))
+        ))
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+def log_recipe_ingredients_change(instance, **kwargs):
+    recipe_id = instance.pk if isinstance(
+        instance, Recipe) else instance.recipe_id
+    transaction.on_commit(
+        partial(log_changes, RECIPE_INGREDIENTS_VERSION, [recipe_id]))
+
+
+def ensure_fulltext_index(using, **kwargs):
+    connection = connections[using]
+    if (connection.vendor == 'sqlite'
+            and fulltext.TABLE in connection.introspection.table_names()):
+        fulltext.ensure_sqlite_index(connection)
+
+
+@receiver(post_save, sender=Recipe)
+def enqueue_recipe_image_renditions(instance, update_fields=None, **kwargs):
+    if (instance.image
+            and (update_fields is None or 'image' in update_fields)
+            and not renditions_ready(instance.image)):
+        create_recipe_image_renditions.delay(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def enqueue_avatar_renditions(instance, update_fields=None, **kwargs):
+    if (instance.avatar
+            and (update_fields is None or 'avatar' in update_fields)
+            and not renditions_ready(instance.avatar)):
+        create_avatar_renditions.delay(instance.pk)
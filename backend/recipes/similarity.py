@@ -0,0 +1,151 @@
+"""
+Похожие рецепты по составу: коэффициент Жаккара множеств id
+ингредиентов.
+
+Полная сборка (build) не сравнивает все пары рецептов: для каждого
+рецепта считается MinHash-подпись, подписи режутся на полосы (LSH),
+и точное сходство считается только для рецептов, совпавших хотя бы
+в одной полосе. Подпись рецепта - поэлементный минимум заранее
+посчитанных подписей его ингредиентов, поэтому строится быстро.
+
+Обновление одного рецепта (update) ищет кандидатов в БД по общим
+ингредиентам. Соседи других рецептов при этом только дополняются
+и очищаются от обновлённого рецепта; полная пересборка
+восстанавливает точные списки.
+"""
+import heapq
+import random
+from collections import defaultdict
+from math import ceil
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .models import RecipeIngredient, SimilarRecipe
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_BUCKET_SIZE = 200
+
+
+def jaccard(first, second):
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+def get_ingredient_sets():
+    """Множества id ингредиентов всех рецептов."""
+    sets = defaultdict(set)
+    for recipe_id, ingredient_id in RecipeIngredient.objects.values_list(
+            'recipe_id', 'ingredient_id').iterator(chunk_size=10000):
+        sets[recipe_id].add(ingredient_id)
+    return sets
+
+
+def get_signatures(sets, permutations, seed=0):
+    """MinHash-подписи множеств через хеши (a * x + b) mod p."""
+    generator = random.Random(seed)
+    coefficients = [
+        (generator.randrange(1, MERSENNE_PRIME),
+         generator.randrange(MERSENNE_PRIME))
+        for _ in range(permutations)
+    ]
+    hashes = {}
+    signatures = {}
+    for key, members in sets.items():
+        rows = []
+        for member in members:
+            if member not in hashes:
+                hashes[member] = tuple(
+                    (a * member + b) % MERSENNE_PRIME
+                    for a, b in coefficients
+                )
+            rows.append(hashes[member])
+        signatures[key] = tuple(map(min, *rows)) if len(
+            rows) > 1 else rows[0]
+    return signatures
+
+
+def get_candidates(signatures, bands):
+    """Пары ключей, у подписей которых совпала хотя бы одна полоса."""
+    rows = len(next(iter(signatures.values()))) // bands
+    candidates = defaultdict(set)
+    for band in range(bands):
+        buckets = defaultdict(list)
+        start = band * rows
+        for key, signature in signatures.items():
+            buckets[signature[start:start + rows]].append(key)
+        for members in buckets.values():
+            # Одинаковые наборы ингредиентов дают огромные корзины:
+            # сравниваем каждый рецепт только с ближайшими в корзине.
+            for position, key in enumerate(members):
+                candidates[key].update(
+                    members[position + 1:position + MAX_BUCKET_SIZE])
+    return candidates
+
+
+def build(limit, min_score, permutations, bands):
+    """
+    Соседи всех рецептов: словарь recipe_id -> [(score, similar_id)],
+    не больше limit на рецепт, по убыванию сходства.
+    """
+    sets = get_ingredient_sets()
+    if not sets:
+        return {}
+    neighbours = defaultdict(list)
+    candidates = get_candidates(get_signatures(sets, permutations), bands)
+    for key, others in candidates.items():
+        for other in others:
+            score = jaccard(sets[key], sets[other])
+            if score < min_score:
+                continue
+            for recipe_id, similar_id in ((key, other), (other, key)):
+                heap = neighbours[recipe_id]
+                if len(heap) < limit:
+                    heapq.heappush(heap, (score, similar_id))
+                elif score > heap[0][0]:
+                    heapq.heapreplace(heap, (score, similar_id))
+    return {
+        recipe_id: sorted(heap, reverse=True)
+        for recipe_id, heap in neighbours.items()
+    }
+
+
+def update(recipe_id):
+    """Пересчитывает соседей рецепта recipe_id по данным в БД."""
+    limit = settings.SIMILAR_RECIPES_LIMIT
+    min_score = settings.SIMILAR_MIN_SCORE
+    SimilarRecipe.objects.filter(
+        Q(recipe=recipe_id) | Q(similar=recipe_id)).delete()
+    ingredient_ids = set(RecipeIngredient.objects.filter(
+        recipe=recipe_id).values_list('ingredient_id', flat=True))
+    if not ingredient_ids:
+        return
+    # Сходство не больше shared / |A|, так что рецепты с меньшим
+    # числом общих ингредиентов можно отбросить сразу.
+    shared = dict(RecipeIngredient.objects.filter(
+        ingredient__in=ingredient_ids
+    ).exclude(recipe=recipe_id).values('recipe').annotate(
+        shared=Count('id')
+    ).filter(
+        shared__gte=ceil(min_score * len(ingredient_ids))
+    ).values_list('recipe', 'shared'))
+    sizes = RecipeIngredient.objects.filter(
+        recipe__in=shared
+    ).values('recipe').annotate(size=Count('id')).values_list(
+        'recipe', 'size')
+    scores = []
+    for similar_id, size in sizes:
+        score = shared[similar_id] / (
+            len(ingredient_ids) + size - shared[similar_id])
+        if score >= min_score:
+            scores.append((score, similar_id))
+    top = heapq.nlargest(limit, scores)
+    SimilarRecipe.objects.bulk_create([
+        SimilarRecipe(recipe_id=recipe_id, similar_id=similar_id,
+                      score=score)
+        for score, similar_id in top
+    ] + [
+        SimilarRecipe(recipe_id=similar_id, similar_id=recipe_id,
+                      score=score)
+        for score, similar_id in top
+    ], ignore_conflicts=True)
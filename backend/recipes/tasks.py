@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from jobs.queue import task
+from . import similarity
+from .models import Recipe, TimelineEntry
+from .renditions import create_renditions, mark_renditions_ready
+
+User = get_user_model()
+
+
+@task
+def create_recipe_image_renditions(*recipe_ids):
+    for recipe in Recipe.objects.filter(pk__in=recipe_ids).only('image'):
+        create_renditions(recipe.image, settings.RECIPE_IMAGE_RENDITIONS)
+        mark_renditions_ready(recipe, 'image')
+
+
+@task
+def create_avatar_renditions(user_id):
+    user = User.objects.filter(pk=user_id).only('avatar').first()
+    if user is not None:
+        create_renditions(user.avatar, settings.AVATAR_RENDITIONS)
+        mark_renditions_ready(user, 'avatar')
+
+
+@task
+def fan_out_recipes(*recipe_ids):
+    TimelineEntry.objects.fan_out(recipe_ids)
+
+
+@task
+def update_similar_recipes(*recipe_ids):
+    for recipe_id in recipe_ids:
+        similarity.update(recipe_id)
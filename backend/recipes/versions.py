@@ -0,0 +1,165 @@
+import time
+from itertools import chain
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+INGREDIENTS_VERSION = 'ingredients'
+TAGS_VERSION = 'tags'
+RECIPE_INGREDIENTS_VERSION = 'recipe_ingredients'
+SHOPPING_CART_VERSION = 'shopping_cart:{}'
+VERSION_KEY = 'data_version:{}'
+CHANGES_KEY = 'data_changes:{}'
+CHANGE_KEY = 'data_changes:{}:{}'
+LOCAL_VALUES_LIMIT = 10000
+
+# Копии значений общего кэша в памяти процесса:
+# ключ -> (время проверки по time.monotonic, значение).
+_local = {}
+
+
+def remember(key, value, checked=None):
+    if len(_local) >= LOCAL_VALUES_LIMIT:
+        _local.clear()
+    _local[key] = (
+        time.monotonic() if checked is None else checked, value)
+
+
+def recall(key):
+    """
+    Значение key из памяти процесса, если оно сверено с общим кэшем
+    не раньше DATA_VERSION_CHECK_INTERVAL секунд назад, иначе None.
+    """
+    checked, value = _local.get(key, (None, None))
+    if checked is None or (
+            time.monotonic() - checked
+            >= settings.DATA_VERSION_CHECK_INTERVAL):
+        return None
+    return value
+
+
+def get_shared(keys, fresh=False):
+    """
+    Значения keys из общего кэша. Сверенные с ним не раньше
+    DATA_VERSION_CHECK_INTERVAL секунд назад берутся из памяти
+    процесса (если не задан fresh), остальные читаются одним запросом.
+    Ключей, которых нет в кэше, нет и в результате.
+    """
+    values = {}
+    if not fresh:
+        for key in keys:
+            value = recall(key)
+            if value is not None:
+                values[key] = value
+    missing = [key for key in keys if key not in values]
+    if missing:
+        checked = time.monotonic()
+        values.update(cache.get_many(missing))
+        for key in missing:
+            if key in values:
+                remember(key, values[key], checked)
+    return values
+
+
+def get_versions(*names, journals=()):
+    """
+    Текущие версии наборов данных names.
+    Версии хранятся в кэше Django (DatabaseCache, см. CACHES), общем
+    для процессов gunicorn, воркера и management-команд. Процесс
+    сверяется с ним не чаще DATA_VERSION_CHECK_INTERVAL секунд,
+    поэтому изменения из других процессов видны с такой задержкой,
+    а свои - сразу. Номера последних записей журналов наборов journals
+    читаются тем же запросом, и get_last_change их уже не запрашивает.
+    """
+    keys = [VERSION_KEY.format(name) for name in names]
+    journal_keys = [CHANGES_KEY.format(name) for name in journals]
+    values = get_shared(keys + journal_keys)
+    for key in journal_keys:
+        if key not in values:
+            remember(key, 0)
+    for key in keys:
+        if key not in values:
+            cache.add(key, uuid4().hex, timeout=None)
+            values[key] = cache.get(key)
+            remember(key, values[key])
+    return tuple(values[key] for key in keys)
+
+
+def get_version(name):
+    """Текущая версия набора данных name, см. get_versions."""
+    return get_versions(name)[0]
+
+
+def bump_version(*names):
+    """Помечает наборы данных names изменёнными."""
+    versions = {VERSION_KEY.format(name): uuid4().hex for name in names}
+    cache.set_many(versions, timeout=None)
+    for key, version in versions.items():
+        remember(key, version)
+
+
+def bump_shopping_cart_versions(user_ids):
+    """Помечает изменёнными списки покупок пользователей."""
+    names = [SHOPPING_CART_VERSION.format(user_id) for user_id in user_ids]
+    if names:
+        bump_version(*names)
+
+
+def log_changes(name, ids):
+    """
+    Записывает в журнал набора данных name id изменённых объектов.
+    Журнал позволяет процессам обновить свои данные в памяти по
+    изменившимся объектам, а не перестраивать их целиком.
+    """
+    # incr в DatabaseCache не атомарен, а add - атомарен: номер записи
+    # занимается добавлением её ключа, счётчик только подсказывает,
+    # с какого номера начинать.
+    number = get_last_change(name, fresh=True)
+    while True:
+        number += 1
+        if cache.add(
+                CHANGE_KEY.format(name, number), list(ids),
+                timeout=settings.DATA_CHANGES_TIMEOUT):
+            break
+    if number > get_last_change(name, fresh=True):
+        cache.set(CHANGES_KEY.format(name), number, timeout=None)
+        remember(CHANGES_KEY.format(name), number)
+
+
+def get_last_change(name, fresh=False):
+    """
+    Номер последней записи журнала набора данных name. Как и версия,
+    сверяется с общим кэшем не чаще DATA_VERSION_CHECK_INTERVAL
+    секунд, если не задан fresh.
+    """
+    key = CHANGES_KEY.format(name)
+    number = get_shared([key], fresh).get(key)
+    if number is None:
+        number = 0
+        remember(key, number)
+    return number
+
+
+def get_changes(name, since):
+    """
+    Номер последней записи журнала name и id объектов, изменённых
+    после записи since. Вместо id возвращается None, если часть
+    записей уже вытеснена из кэша, счётчик журнала сброшен или записей
+    слишком много: тогда данные нужно перестроить целиком.
+    """
+    last = get_last_change(name)
+    if last < since:
+        return last, None
+    if last == since:
+        return last, set()
+    if last - since > settings.DATA_CHANGES_LIMIT:
+        return last, None
+    keys = [
+        CHANGE_KEY.format(name, number)
+        for number in range(since + 1, last + 1)
+    ]
+    entries = cache.get_many(keys)
+    if len(entries) < len(keys):
+        return last, None
+    return last, set(chain.from_iterable(entries.values()))
@@ -14,8 +14,11 @@ class UserAdmin(BaseUserAdmin):
         'email',
         'first_name',
         'last_name',
-        'avatar'
+        'avatar',
+        'recipes_count',
+        'followers_count'
     )
+    readonly_fields = ('recipes_count', 'followers_count')
     list_display_links = ('id', 'username')
     search_fields = ('username', 'email')
     list_filter = ('is_staff', 'is_active', 'is_superuser')
@@ -37,6 +40,7 @@ class UserAdmin(BaseUserAdmin):
              'groups',
              'user_permissions')}),
         ('Important dates', {'fields': ('last_login', 'date_joined')}),
+        ('Counters', {'fields': ('recipes_count', 'followers_count')}),
     )
 
 
@@ -13,6 +13,9 @@ PASSWORD_VERBOSE = 'Пароль'
 AVATAR_VERBOSE = 'Аватар пользователя'
 AVATAR_HELP = 'вы можете загрузить отображаемое фото'
 AVATAR_UPLOAD_TO = 'users/avatars'
+AVATAR_RENDITIONS_VERBOSE = 'Варианты аватара созданы для'
+RECIPES_COUNT_VERBOSE = 'Рецептов'
+FOLLOWERS_COUNT_VERBOSE = 'Подписчиков'
 USER_VERBOSE = 'пользователь'
 USER_VERBOSE_PLURAL = 'пользователи'
 FOLLOWER_UNIQUE_CONSTRAINT_NAME = 'me0'
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 03:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='foodgramuser',
+            name='avatar_renditions',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='Варианты аватара созданы для'),
+        ),
+    ]
@@ -6,7 +6,8 @@ from .constants import (
     USERNAME_MAX_LENGTH, EMAIL_MAX_LENGTH, NAME_MAX_LENGTH,
     USERNAME_VERBOSE, USERNAME_HELP, EMAIL_VERBOSE, EMAIL_HELP,
     FIRST_NAME_VERBOSE, FIRST_NAME_HELP, LAST_NAME_VERBOSE,
-    AVATAR_VERBOSE, AVATAR_HELP, AVATAR_UPLOAD_TO,
+    AVATAR_VERBOSE, AVATAR_HELP, AVATAR_UPLOAD_TO, AVATAR_RENDITIONS_VERBOSE,
+    RECIPES_COUNT_VERBOSE, FOLLOWERS_COUNT_VERBOSE,
     USER_VERBOSE, USER_VERBOSE_PLURAL,
     FOLLOWER_UNIQUE_CONSTRAINT_NAME, FOLLOWER_CHECK_CONSTRAINT_NAME
 )
@@ -43,6 +44,23 @@ class FoodgramUser(AbstractUser):
         null=True,
         blank=True
     )
+    avatar_renditions = models.CharField(
+        verbose_name=AVATAR_RENDITIONS_VERBOSE,
+        max_length=255,
+        blank=True,
+        default='',
+        editable=False,
+    )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name=RECIPES_COUNT_VERBOSE,
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name=FOLLOWERS_COUNT_VERBOSE,
+        default=0,
+        editable=False,
+    )
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['first_name', 'last_name', 'username']
 